@@ -9,6 +9,10 @@ from logging.handlers import SMTPHandler, RotatingFileHandler
 import os
 from flask_mail import Mail
 from flask_moment import Moment
+from app.geocache import GeocodeCache
+from app.httpcache import HttpCacheStore
+from app.authcache import AuthCache
+from app.lastseen import LastSeenBuffer
 
 # app = Flask(__name__)
 # app.config.from_object(Config)
@@ -32,6 +36,10 @@ login.login_view = "auth.login"
 login.login_message = "Please log in to access this page."
 mail = Mail()
 moment = Moment()
+geocache = GeocodeCache()
+httpcache = HttpCacheStore()
+authcache = AuthCache()
+lastseen = LastSeenBuffer()
 #babel = Babel()
 
 def create_app(config_class=Config):
@@ -43,6 +51,10 @@ def create_app(config_class=Config):
     login.init_app(app)
     mail.init_app(app)
     moment.init_app(app)
+    geocache.init_app(app)
+    httpcache.init_app(app)
+    authcache.init_app(app)
+    lastseen.init_app(app)
     #babel.init_app(app)
 
     #register blueprints
@@ -64,6 +76,12 @@ def create_app(config_class=Config):
     from app.crawler import bp as crawler_bp
     app.register_blueprint(crawler_bp)
 
+    from app.ics import bp as ics_bp
+    app.register_blueprint(ics_bp)
+
+    from app.cli import bp as cli_bp
+    app.register_blueprint(cli_bp)
+
     if not app.debug and not app.testing:
         if app.config['MAIL_SERVER']:
             auth = None
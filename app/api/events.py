@@ -4,8 +4,11 @@ from flask import url_for, abort
 from app import db
 from app.api.errors import bad_request
 import sqlalchemy as sa
+from datetime import datetime, timezone
 from flask import request
 from app.api.auth import token_auth
+from app.pagination import InvalidCursor
+import app.geohash as geohash
 
 #NEED TO CONFIRM TOKEN IS AUTHED FOR EVENTS TIED TO THAT USER
 
@@ -14,13 +17,140 @@ from app.api.auth import token_auth
 def get_event(id):
     return db.get_or_404(Event, id).to_dict()
 
+FILTERS = ['starts_after', 'starts_before', 'ends_after', 'ends_before', 'owner', 'feed',
+           'category', 'bbox']
+
+def parse_datetime(value):
+    #ISO 8601; aware values are converted to the naive UTC the columns store
+    value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def event_filters(args):
+    #WHERE clauses for the filter query parameters; raises ValueError on bad values
+    filters = []
+    if 'starts_after' in args:
+        filters.append(Event.starts_at >= parse_datetime(args['starts_after']))
+    if 'starts_before' in args:
+        filters.append(Event.starts_at < parse_datetime(args['starts_before']))
+    #an event with no end is a point in time, for both end filters
+    ends_at = sa.func.coalesce(Event.ends_at, Event.starts_at)
+    if 'ends_after' in args: #events still running at the time
+        filters.append(ends_at >= parse_datetime(args['ends_after']))
+    if 'ends_before' in args:
+        filters.append(ends_at < parse_datetime(args['ends_before']))
+    if 'owner' in args:
+        filters.append(Event.user_id == sa.select(User.id).where(
+            User.username == args['owner']).scalar_subquery())
+    if 'feed' in args:
+        filters.append(Event.feed_id == int(args['feed']))
+    if 'category' in args:
+        filters.append(Event.original_event_category == args['category'])
+    if 'bbox' in args:
+        #min_lon,min_lat,max_lon,max_lat as in GeoJSON; min_lon > max_lon crosses the antimeridian
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in args['bbox'].split(','))
+        if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+            raise ValueError(f"invalid bbox {args['bbox']!r}")
+        filters.append(Event.location_lat.between(min_lat, max_lat))
+        if min_lon <= max_lon:
+            filters.append(Event.location_lon.between(min_lon, max_lon))
+        else:
+            filters.append(sa.or_(Event.location_lon >= min_lon, Event.location_lon <= max_lon))
+    return filters
+
 @bp.route('/events', methods=['GET'])
 #@token_auth.login_required
 def get_events():
-    page = request.args.get('page', 1, type=int)
-    per_page = min(request.args.get('per_page', 10, type=int), 100)
-    return Event.to_collection_dict(sa.select(Event), page, per_page,
-                                   'api.get_events')
+    per_page = max(1, min(request.args.get('per_page', 10, type=int), 100))
+    try:
+        filters = event_filters(request.args)
+    except ValueError as e:
+        return bad_request(f'invalid filter: {e}')
+    #links to other pages keep the filters
+    filter_args = {name: request.args[name] for name in FILTERS if name in request.args}
+    query = sa.select(Event).where(*filters)
+    if 'page' in request.args: #offset pagination, kept for existing clients
+        page = request.args.get('page', 1, type=int)
+        return Event.to_collection_dict(query, page, per_page,
+                                       'api.get_events', **filter_args)
+    count = request.args.get('count', 0, type=int) == 1 #total_items costs a COUNT(*)
+    try:
+        return Event.to_cursor_dict(query, (Event.starts_at, Event.id), per_page,
+                                    request.args.get('cursor'), 'api.get_events', count=count,
+                                    **filter_args)
+    except InvalidCursor as e:
+        return bad_request(str(e))
+
+def geohash_ranges(boxes, max_cells=32):
+    #index range scans on Event.geohash covering boxes; candidates still need an exact check
+    ranges = []
+    for box in boxes:
+        for prefix in geohash.cover(*box, max_cells=max_cells):
+            end = geohash.successor(prefix)
+            ranges.append(Event.geohash >= prefix if end is None else
+                          sa.and_(Event.geohash >= prefix, Event.geohash < end))
+    return sa.or_(*ranges)
+
+@bp.route('/events/nearby', methods=['GET'])
+#@token_auth.login_required
+def get_nearby_events():
+    #events within km of lat/lon, nearest first; accepts the /events filters too
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        km = float(request.args.get('km', 10))
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180 and 0 < km <= 1000):
+            raise ValueError('lat, lon or km out of range')
+        filters = event_filters(request.args)
+    except KeyError as e:
+        return bad_request(f'missing {e.args[0]}')
+    except ValueError as e:
+        return bad_request(f'invalid filter: {e}')
+    limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+    candidates = db.session.execute(
+        sa.select(Event.id, Event.location_lat, Event.location_lon)
+        .where(geohash_ranges(geohash.boxes_around(lat, lon, km)), *filters))
+    matches = sorted((distance, id) for id, event_lat, event_lon in candidates
+                     if (distance := geohash.haversine_km(lat, lon, event_lat, event_lon)) <= km)
+    events = {event.id: event for event in db.session.scalars(
+        sa.select(Event).where(Event.id.in_([id for _, id in matches[:limit]])))}
+    items = []
+    for distance, id in matches[:limit]:
+        item = events[id].to_dict()
+        item['distance_km'] = round(distance, 3)
+        items.append(item)
+    return {
+        'items': items,
+        '_meta': {'lat': lat, 'lon': lon, 'km': km, 'limit': limit, 'total_items': len(matches)},
+    }
+
+@bp.route('/events/tile/<int:z>/<int:x>/<int:y>', methods=['GET'])
+#@token_auth.login_required
+def get_tile_events(z, x, y):
+    #events inside a Web Mercator map tile, in starts_at order; accepts the /events filters too
+    if not (z <= 22 and x < 2 ** z and y < 2 ** z):
+        return bad_request('no such tile')
+    try:
+        filters = event_filters(request.args)
+    except ValueError as e:
+        return bad_request(f'invalid filter: {e}')
+    limit = max(1, min(request.args.get('limit', 500, type=int), 1000))
+    min_lat, min_lon, max_lat, max_lon = geohash.tile_bounds(z, x, y)
+    query = (
+        sa.select(Event)
+        .where(geohash_ranges([(min_lat, min_lon, max_lat, max_lon)]),
+               Event.location_lat.between(min_lat, max_lat),
+               Event.location_lon.between(min_lon, max_lon), *filters)
+        .order_by(Event.starts_at, Event.id)
+        .limit(limit + 1)
+    )
+    events = db.session.scalars(query).all()
+    return {
+        'items': [event.to_dict() for event in events[:limit]],
+        '_meta': {'z': z, 'x': x, 'y': y, 'bounds': [min_lon, min_lat, max_lon, max_lat],
+                  'limit': limit, 'truncated': len(events) > limit},
+    }
 
 @bp.route('/events', methods=['POST'])
 @token_auth.login_required
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+import sqlalchemy as sa
+
+#in-process cache of authenticated users for load_user and check_token, so most requests
+#authenticate without a query. Entries are detached copies of User rows kept for a short TTL;
+#callers merge them into their session with load=False. A user is evicted when their row is
+#flushed (profile edits, new or revoked tokens), by revoke_token() directly and again when the
+#write commits. set() is given the generation read before the row was loaded and skips the
+#copy if anything was evicted since, so a row read before a commit is not cached after it.
+#Other processes only see a revocation once their copy expires, so the TTL bounds how long a
+#revoked token keeps working there
+
+class AuthCache:
+    def __init__(self, app=None, clock=time.monotonic):
+        self.clock = clock
+        self.ttl = 60
+        self.maxsize = 1024
+        self.users = OrderedDict() #user id -> (detached copy, expires_at)
+        self.tokens = {} #token -> user id
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.generation = 0 #bumped by every evict()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config['AUTH_CACHE_TTL']
+        self.maxsize = app.config['AUTH_CACHE_SIZE']
+        self.clear()
+        app.extensions['auth_cache'] = self
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+            self.tokens.clear()
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def drop(self, id):
+        entry = self.users.pop(id, None)
+        if entry is not None and entry[0].token is not None:
+            self.tokens.pop(entry[0].token, None)
+        return entry
+
+    def get(self, id):
+        #the cached copy of user id, or None
+        if not self.ttl:
+            return None
+        with self.lock:
+            entry = self.users.get(id)
+            if entry is not None and entry[1] <= self.clock():
+                self.drop(id)
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.users.move_to_end(id)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def get_token(self, token):
+        #the cached copy of the user holding token, or None; expiry is the caller's check
+        with self.lock:
+            id = self.tokens.get(token)
+            if id is None:
+                self.stats['misses'] += 1
+                return None
+        user = self.get(id)
+        return user if user is not None and user.token == token else None
+
+    def set(self, user, generation=None):
+        #generation is self.generation as read before user was loaded
+        if not self.ttl:
+            return
+        mapper = sa.inspect(user).mapper
+        copy = mapper.class_(**{attr.key: getattr(user, attr.key) for attr in mapper.column_attrs})
+        sa.orm.make_transient_to_detached(copy)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return #evicted while the row was loading; it may be stale
+            self.drop(copy.id)
+            self.users[copy.id] = (copy, self.clock() + self.ttl)
+            if copy.token is not None:
+                self.tokens[copy.token] = copy.id
+            while len(self.users) > self.maxsize:
+                self.drop(next(iter(self.users)))
+
+    def evict(self, id):
+        with self.lock:
+            self.generation += 1
+            if self.drop(id) is not None:
+                self.stats['evictions'] += 1
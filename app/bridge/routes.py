@@ -12,12 +12,12 @@ from flask import make_response, request
 
 from app.bridge import bp
 #from app.bridge import openlands
-import feeds
+from app.sources import get_source
 
 
 @bp.route('/bridge/openlands', methods=['GET'])
 def openlands_bridge():
-    data = feeds.Openlands.get(request.args.get('format', default="bridge"))
+    data = get_source('Openlands').get(request.args.get('format', default="bridge"))
     return data
     # rss_xml = openlands.create_feed()
     # response = make_response(rss_xml)
@@ -26,5 +26,5 @@ def openlands_bridge():
 
 @bp.route('/bridge/chihacknight', methods=['GET'])
 def chihacknight_bridge():
-    data = feeds.ChiHackNight.get(request.args.get('status', default="upcoming"))
+    data = get_source('ChiHackNight').get(request.args.get('status', default="upcoming"))
     return data
\ No newline at end of file
@@ -0,0 +1,70 @@
+import threading
+from datetime import datetime, timedelta, timezone
+import click
+from flask import Blueprint, current_app
+
+bp = Blueprint('cli', __name__, cli_group=None)
+
+
+@bp.cli.group()
+def geocode():
+    """Background geocoding commands."""
+    pass
+
+
+@geocode.command()
+@click.option('--loop', is_flag=True, help='Keep polling for new pending events.')
+@click.option('--idle', default=5.0, help='Seconds to wait between polls with --loop.')
+def run(loop, idle):
+    """Resolve events flagged geocode_pending."""
+    from app.geocoding import GeocodeQueue
+    queue = GeocodeQueue.from_config(current_app.config)
+    queue.run(stop=threading.Event() if loop else None, idle=idle)
+
+
+@bp.cli.group()
+def feeds():
+    """Feed refresh commands."""
+    pass
+
+
+@feeds.command('run')
+@click.option('--loop', is_flag=True, help='Keep polling for due feeds.')
+@click.option('--poll', default=60.0, help='Seconds to wait between polls with --loop.')
+def run_feeds(loop, poll):
+    """Refresh feeds whose refresh interval has passed."""
+    from app.scheduler import Scheduler
+    scheduler = Scheduler.from_config(current_app._get_current_object())
+    scheduler.run(stop=threading.Event() if loop else None, poll=poll)
+
+
+@feeds.command('refresh')
+@click.argument('feed_id', type=int)
+@click.option('--bulk', is_flag=True, help='Write through the bulk upsert path.')
+@click.option('--full', is_flag=True, help='Fetch every event instead of only new and due ones.')
+def refresh_feed(feed_id, bulk, full):
+    """Refresh one feed now and record the run."""
+    from app.scheduler import record_refresh
+    run = record_refresh(feed_id, bulk=bulk, incremental=not full)
+    if run is None:
+        raise click.ClickException(f'no such feed: {feed_id}')
+    click.echo(f"{run['status']} in {run['duration']:.2f}s: {run['inserted']} inserted, "
+               f"{run['updated']} updated, {run['deleted']} deleted, {run['unchanged']} unchanged")
+
+
+@feeds.command()
+@click.option('--limit', default=10, help='Number of feeds to list.')
+@click.option('--days', default=7.0, help='Only runs started in the last DAYS days.')
+def report(limit, days):
+    """List the slowest feeds and refresh stages."""
+    from app.scheduler import slowest_feeds, stage_averages
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    click.echo(f'{"feed":<30} {"runs":>5} {"avg s":>8} {"max s":>8} {"failed":>6} '
+               f'{"requests":>8} {"fresh":>6} {"304":>6}')
+    for feed, runs, avg, longest, failed, requests, fresh, not_modified in slowest_feeds(limit, since):
+        click.echo(f'{feed.name[:30]:<30} {runs:>5} {avg or 0:>8.2f} {longest or 0:>8.2f} {failed:>6} '
+                   f'{requests or 0:>8} {fresh or 0:>6} {not_modified or 0:>6}')
+    click.echo()
+    click.echo(f'{"stage":<30} {"avg s":>8}  (summed over threads)')
+    for stage, seconds in stage_averages(since):
+        click.echo(f'{stage:<30} {seconds:>8.2f}')
@@ -0,0 +1,69 @@
+import re
+
+#coordinate parsing without geocoding. Patterns are compiled once at import.
+#Accepted forms (comma, semicolon or whitespace between latitude and longitude):
+#  "40.7128, -74.0060"  "40.7128N, 74.0060W"  "N 40.7128 W 74.0060"  "40.7128° N 74.0060° W"
+#  "40°42'46\"N, 74°0'22\"W"  "40 42 46 N 74 0 22 W"  "40:42.77N 74:0.37W"
+
+def _decimal(h):
+    return rf"([{h}])?\s*([+-]?\d{{1,3}}(?:\.\d+)?)\s*°?\s*([{h}])?"
+
+def _dms(h):
+    return (rf"([{h}])?\s*([+-]?\d{{1,3}})\s*[°º:\s]\s*(\d{{1,2}}(?:\.\d+)?)\s*['′’:]?\s*"
+            rf"(?:(\d{{1,2}}(?:\.\d+)?)\s*(?:[\"″”]|'')?)?\s*([{h}])?")
+
+#latitude first; hemisphere letters are only accepted on the matching axis
+DECIMAL_PAIR = re.compile(rf"^\s*{_decimal('NS')}\s*(?:[,;]|\s)\s*{_decimal('EW')}\s*$", re.IGNORECASE)
+DMS_PAIR = re.compile(rf"^\s*{_dms('NS')}\s*(?:[,;]|\s)\s*{_dms('EW')}\s*$", re.IGNORECASE)
+
+def _signed(value, sign, prefix, suffix, negative):
+    hemispheres = {h.upper() for h in (prefix, suffix) if h}
+    if len(hemispheres) > 1:
+        return None
+    if negative in hemispheres:
+        if sign:
+            return None #"-40 S" is ambiguous
+        return -value
+    return -value if sign else value
+
+def _pair(lat, lon):
+    if lat is None or lon is None:
+        return None
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
+        return (lat, lon)
+    return None
+
+def _parse_decimal(groups):
+    lat_pre, lat, lat_suf, lon_pre, lon, lon_suf = groups
+    return _pair(
+        _signed(abs(float(lat)), lat.startswith('-'), lat_pre, lat_suf, 'S'),
+        _signed(abs(float(lon)), lon.startswith('-'), lon_pre, lon_suf, 'W'))
+
+def _dms_value(deg, minutes, seconds):
+    minutes = float(minutes)
+    seconds = float(seconds) if seconds else 0.0
+    if minutes >= 60 or seconds >= 60:
+        return None
+    return abs(int(deg)) + minutes / 60 + seconds / 3600
+
+def _parse_dms(groups):
+    lat_pre, lat_deg, lat_min, lat_sec, lat_suf, lon_pre, lon_deg, lon_min, lon_sec, lon_suf = groups
+    lat = _dms_value(lat_deg, lat_min, lat_sec)
+    lon = _dms_value(lon_deg, lon_min, lon_sec)
+    if lat is None or lon is None:
+        return None
+    return _pair(
+        _signed(lat, lat_deg.startswith('-'), lat_pre, lat_suf, 'S'),
+        _signed(lon, lon_deg.startswith('-'), lon_pre, lon_suf, 'W'))
+
+def parse_coordinates(text):
+    #returns (lat, lon) in decimal degrees, or None if text is not a coordinate pair
+    if not text:
+        return None
+    match = DECIMAL_PAIR.match(text)
+    if match:
+        return _parse_decimal(match.groups())
+    match = DMS_PAIR.match(text)
+    if match:
+        return _parse_dms(match.groups())
+    return None
@@ -1,7 +1,6 @@
 from flask import make_response, request
 
 from app.crawler import bp
-from app.crawler import org_crawler
 
 @bp.route('/crawler/<path:url>')
 def crawl(url):
@@ -10,4 +9,6 @@ def crawl(url):
     else:
         full_url = url
     #return f"Retrieved URL: {full_url}"
+    #playwright and extruct are imported on the first crawl rather than at app startup
+    from app.crawler import org_crawler
     return org_crawler.run_report(full_url)
\ No newline at end of file
@@ -0,0 +1,61 @@
+import hashlib
+import struct
+from datetime import datetime, timezone
+import sqlalchemy as sa
+
+#content fingerprints over a fixed, declared tuple of fields. Values are fed to sha256 one at a
+#time in field order, each tagged and length-prefixed, so no sorted or serialized copy of the
+#record is built and None, '' and 'None' all hash differently
+
+CACHE_ATTR = '_fingerprint'
+
+def to_utc(value):
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def encode(value):
+    if value is None:
+        return b'N'
+    if isinstance(value, datetime):
+        data = value.isoformat().encode('utf-8')
+    else:
+        data = str(value).encode('utf-8')
+    return b'S' + struct.pack('>I', len(data)) + data
+
+class Fingerprint:
+    def __init__(self, fields, datetime_fields=()):
+        self.fields = tuple(fields)
+        self.datetime_fields = frozenset(datetime_fields)
+
+    def digest(self, get):
+        sha = hashlib.sha256()
+        for field in self.fields:
+            value = get(field)
+            if value and field in self.datetime_fields:
+                value = to_utc(value)
+            sha.update(encode(value))
+        return sha.hexdigest()
+
+    def of_mapping(self, data):
+        return self.digest(data.get)
+
+    def of_instance(self, obj):
+        #cached until one of the hashed attributes is set (see track)
+        cached = obj.__dict__.get(CACHE_ATTR)
+        if cached is None:
+            cached = self.digest(lambda field: getattr(obj, field))
+            obj.__dict__[CACHE_ATTR] = cached
+        return cached
+
+    @staticmethod
+    def invalidate(obj, *args):
+        obj.__dict__.pop(CACHE_ATTR, None)
+
+    def track(self, cls):
+        #drop the cached digest whenever a hashed attribute changes or is reloaded
+        for field in self.fields:
+            sa.event.listen(getattr(cls, field), 'set', self.invalidate)
+        sa.event.listen(cls, 'refresh', self.invalidate)
+        sa.event.listen(cls, 'expire', self.invalidate)
+        return cls
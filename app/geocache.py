@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+#two-tier cache for geocoder results keyed by normalized address: an in-process LRU in front of
+#an optional SQLite table that survives restarts. Failed lookups are cached too (negative
+#entries, stored as None) with their own shorter TTL
+
+MISS = object()
+
+def normalize_address(address):
+    return ' '.join(address.casefold().split())
+
+class GeocodeCache:
+    def __init__(self, app=None, clock=time.time):
+        self.clock = clock
+        self.path = None
+        self.ttl = 30 * 24 * 3600
+        self.negative_ttl = 24 * 3600
+        self.maxsize = 1024
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = None
+        self.stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'stores': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config['GEOCODE_CACHE_PATH']
+        if self.path and not os.path.isabs(self.path):
+            self.path = os.path.join(app.instance_path, self.path)
+        self.ttl = app.config['GEOCODE_CACHE_TTL']
+        self.negative_ttl = app.config['GEOCODE_NEGATIVE_TTL']
+        self.maxsize = app.config['GEOCODE_CACHE_SIZE']
+        self.clear()
+        app.extensions['geocode_cache'] = self
+
+    def connect(self):
+        if self.connection is None and self.path:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS geocode_cache '
+                '(address TEXT PRIMARY KEY, lat REAL, lon REAL, expires_at REAL NOT NULL)')
+        return self.connection
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def remember(self, key, coords, expires_at):
+        self.memory[key] = (coords, expires_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def get(self, address):
+        #returns (lat, lon), None for a cached failure, or MISS
+        key = normalize_address(address)
+        now = self.clock()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and entry[1] > now:
+                self.memory.move_to_end(key)
+            else:
+                entry = None
+                connection = self.connect()
+                if connection is not None:
+                    row = connection.execute(
+                        'SELECT lat, lon, expires_at FROM geocode_cache WHERE address = ?',
+                        (key,)).fetchone()
+                    if row and row[2] > now:
+                        entry = (None if row[0] is None else (row[0], row[1]), row[2])
+                        self.remember(key, *entry)
+            if entry is None:
+                self.stats['misses'] += 1
+                return MISS
+            self.stats['hits' if entry[0] is not None else 'negative_hits'] += 1
+            return entry[0]
+
+    def set(self, address, coords):
+        key = normalize_address(address)
+        coords = tuple(coords) if coords else None
+        expires_at = self.clock() + (self.ttl if coords else self.negative_ttl)
+        with self.lock:
+            self.remember(key, coords, expires_at)
+            self.stats['stores'] += 1
+            connection = self.connect()
+            if connection is not None:
+                lat, lon = coords if coords else (None, None)
+                with connection:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?, ?)',
+                        (key, lat, lon, expires_at))
+
+    def lookup(self, address, geocode):
+        #geocode(address) is only called on a miss; exceptions are not cached
+        coords = self.get(address)
+        if coords is MISS:
+            coords = geocode(address)
+            self.set(address, coords)
+        return coords
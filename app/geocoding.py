@@ -0,0 +1,120 @@
+import importlib
+import threading
+import time
+import requests
+import sqlalchemy as sa
+from flask import current_app
+from app import db, geocache
+from app.models import Event
+import app.location as location
+
+#background geocoding. With GEOCODE_ASYNC set, Event.normalize stores address locations as
+#text with geocode_pending=True; GeocodeQueue resolves them in batches of distinct addresses
+#through a pluggable backend, within a requests-per-second budget, and fills in
+#location_lat/location_lon on every event sharing the address
+
+class NominatimBackend:
+    def geocode(self, address):
+        return location.nominatim_geocode(address)
+
+class CensusBackend:
+    #https://geocoding.geo.census.gov/geocoder/Geocoding_Services_API.html
+    url = 'https://geocoding.geo.census.gov/geocoder/locations/onelineaddress'
+
+    def __init__(self, url=None, timeout=10):
+        self.url = url or self.url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def geocode(self, address):
+        response = self.session.get(self.url, timeout=self.timeout, params={
+            'address': address, 'benchmark': 4, 'format': 'json'})
+        response.raise_for_status()
+        matches = response.json()['result']['addressMatches']
+        if matches:
+            coordinates = matches[0]['coordinates']
+            return (coordinates['y'], coordinates['x'])
+
+BACKENDS = {
+    'nominatim': NominatimBackend,
+    'census': CensusBackend,
+}
+
+def get_backend(name):
+    #a registered name or a 'package.module:Class' path
+    if name in BACKENDS:
+        return BACKENDS[name]()
+    module_name, _, class_name = name.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+class RateLimiter:
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = self.clock()
+            if now < self.next_call:
+                self.sleep(self.next_call - now)
+                now = self.next_call
+            self.next_call = now + self.interval
+
+class GeocodeQueue:
+    def __init__(self, backend, rate=1.0, batch_size=50, limiter=None):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.limiter = limiter or RateLimiter(rate)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(get_backend(config['GEOCODER_BACKEND']), config['GEOCODE_RATE'],
+                   config['GEOCODE_BATCH_SIZE'])
+
+    def geocode(self, address):
+        #only cache misses reach the backend, so only they count against the rate budget
+        self.limiter.wait()
+        return self.backend.geocode(address)
+
+    def run_batch(self):
+        #resolves up to batch_size distinct pending addresses; returns a summary of counts
+        summary = {'addresses': 0, 'resolved': 0, 'failed': 0, 'errors': 0, 'events': 0}
+        addresses = db.session.scalars(
+            sa.select(Event.location).where(Event.geocode_pending)
+            .distinct().limit(self.batch_size)).all()
+        for address in addresses:
+            summary['addresses'] += 1
+            try:
+                #maps links are geocoded by the address they carry, as parse_location does
+                coords = geocache.lookup(location.location_text(address), self.geocode)
+            except ValueError as e: #not a location any backend can resolve
+                current_app.logger.warning(f'Cannot geocode {address!r}: {e}')
+                coords = None
+            except Exception as e:
+                #left pending for the next batch
+                current_app.logger.warning(f'Geocoding {address!r} failed: {e}')
+                summary['errors'] += 1
+                continue
+            lat, lon = coords if coords else (None, None)
+            result = db.session.execute(
+                sa.update(Event)
+                .where(Event.geocode_pending, Event.location == address)
+                .values(location_lat=lat, location_lon=lon, geocode_pending=False,
+                        geohash=Event.location_geohash(lat, lon)))
+            summary['resolved' if coords else 'failed'] += 1
+            summary['events'] += result.rowcount
+        db.session.commit()
+        if summary['addresses']:
+            current_app.logger.info(f'Geocoding batch: {summary}')
+        return summary
+
+    def run(self, stop=None, idle=5.0):
+        #drains the queue; keeps polling every idle seconds until stop is set if stop is given
+        while True:
+            summary = self.run_batch()
+            if summary['addresses'] == summary['errors']:
+                if stop is None or stop.wait(idle):
+                    return
@@ -0,0 +1,109 @@
+import math
+
+#geohash encoding and covering. A geohash interleaves longitude and latitude bits into base32
+#characters, so every prefix is a lat/lon cell and all points in a cell share the prefix. A
+#region query becomes a few index range scans (geohash >= prefix AND geohash < successor(prefix))
+#followed by an exact distance or bounds check on the candidates. Both bounds are made of base32
+#characters, which sort the same way under byte order and the usual linguistic collations
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+DECODE = {c: i for i, c in enumerate(BASE32)}
+PRECISION = 9 #stored precision, cells of about 4.8m x 4.8m
+EARTH_RADIUS_KM = 6371.0088
+
+def encode(lat, lon, precision=PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True #bits alternate, starting with longitude
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+def bounds(geohash):
+    #(min_lat, min_lon, max_lat, max_lon) of the cell
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = DECODE[char]
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            mid = (interval[0] + interval[1]) / 2
+            if value >> shift & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+def cell_size(precision):
+    #(degrees latitude, degrees longitude) of a cell
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+def cover(min_lat, min_lon, max_lat, max_lon, max_cells=32):
+    #sorted geohash prefixes whose cells together contain the box, using the longest prefixes
+    #that need no more than max_cells cells
+    for precision in range(PRECISION, 0, -1):
+        dlat, dlon = cell_size(precision)
+        rows = math.floor(max_lat / dlat) - math.floor(min_lat / dlat) + 1
+        columns = math.floor(max_lon / dlon) - math.floor(min_lon / dlon) + 1
+        if rows * columns <= max_cells or precision == 1:
+            break
+    lats = [min_lat + i * dlat for i in range(rows)] + [max_lat]
+    lons = [min_lon + i * dlon for i in range(columns)] + [max_lon]
+    return sorted({encode(lat, lon, precision) for lat in lats for lon in lons})
+
+def successor(prefix):
+    #the first prefix of the same or shorter length after every geohash starting with prefix,
+    #or None when nothing sorts after it ('zz...')
+    prefix = prefix.rstrip(BASE32[-1])
+    if not prefix:
+        return None
+    return prefix[:-1] + BASE32[DECODE[prefix[-1]] + 1]
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def boxes_around(lat, lon, km):
+    #bounding boxes containing every point within km of (lat, lon); two when the circle
+    #crosses the antimeridian
+    dlat = math.degrees(km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return [(min_lat, -180.0, max_lat, 180.0)] #a pole is inside the circle
+    dlon = math.degrees(km / (EARTH_RADIUS_KM * math.cos(math.radians(max(abs(min_lat), abs(max_lat))))))
+    if dlon >= 180:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180:
+        return [(min_lat, min_lon + 360, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon - 360)]
+    return [(min_lat, min_lon, max_lat, max_lon)]
+
+def tile_bounds(z, x, y):
+    #(min_lat, min_lon, max_lat, max_lon) of a Web Mercator (slippy map) tile
+    n = 2 ** z
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return lat(y + 1), x / n * 360.0 - 180.0, lat(y), (x + 1) / n * 360.0 - 180.0
@@ -0,0 +1,76 @@
+import json
+import os
+import sqlite3
+import threading
+
+#persistent tier behind the conditional-request cache of feeds.HttpClient: the validators,
+#body hash and parse result of each cached response, in a SQLite file that survives restarts.
+#A new process, or a one-off `flask feeds run`, revalidates its first fetches with the stored
+#ETag/Last-Modified instead of downloading and parsing every page again. Parse results are
+#stored as JSON; one that cannot be serialized is kept in memory only
+
+class HttpCacheStore:
+    def __init__(self, app=None):
+        self.path = None
+        self.connection = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config['FEED_HTTP_CACHE_PATH']
+        if self.path and not os.path.isabs(self.path):
+            self.path = os.path.join(app.instance_path, self.path)
+        self.close()
+        app.extensions['http_cache'] = self
+
+    def connect(self):
+        if self.connection is None and self.path:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS http_cache (key TEXT PRIMARY KEY, etag TEXT, '
+                'last_modified TEXT, body_hash TEXT NOT NULL, parsed TEXT, checked REAL NOT NULL)')
+        return self.connection
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def get(self, key):
+        #(etag, last_modified, body_hash, parsed, checked) or None
+        with self.lock:
+            connection = self.connect()
+            if connection is None:
+                return None
+            row = connection.execute(
+                'SELECT etag, last_modified, body_hash, parsed, checked FROM http_cache WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, body_hash, parsed, checked = row
+        return etag, last_modified, body_hash, json.loads(parsed), checked
+
+    def set(self, key, etag, last_modified, body_hash, parsed, checked):
+        try:
+            parsed = json.dumps(parsed)
+        except (TypeError, ValueError):
+            return
+        with self.lock:
+            connection = self.connect()
+            if connection is not None:
+                with connection:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?)',
+                        (key, etag, last_modified, body_hash, parsed, checked))
+
+    def touch(self, key, checked):
+        #records that the server confirmed the stored entry at checked
+        with self.lock:
+            connection = self.connect()
+            if connection is not None:
+                with connection:
+                    connection.execute('UPDATE http_cache SET checked = ? WHERE key = ?',
+                                       (checked, key))
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+bp = Blueprint('ics', __name__)
+
+from app.ics import routes
\ No newline at end of file
@@ -0,0 +1,93 @@
+import hashlib
+from datetime import timezone
+
+#iCalendar (RFC 5545) output. A calendar is produced as a stream of text chunks from an
+#iterable of event rows, so an export never holds more than a chunk in memory. The ETag of a
+#calendar is a digest of its name and the (id, hash) of its events in order. Event.hash covers
+#every field written here but id and timestamp, which never change, so the ETag changes
+#exactly when the output does
+
+VERSION = '1' #bumped when the output format changes, so cached copies are replaced
+PRODID = '-//events-calendar//iCalendar export//EN'
+CHUNK_SIZE = 16 * 1024
+
+#Event columns a VEVENT is written from
+COLUMNS = ('id', 'title', 'description', 'starts_at', 'ends_at', 'location', 'location_desc',
+           'original_event_url', 'original_event_category', 'timestamp')
+
+def escape_text(value):
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n'))
+
+def format_datetime(value):
+    #UTC date-time; naive values are stored as UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+def fold(line):
+    #content lines longer than 75 octets continue on lines starting with a space, split
+    #between characters rather than inside a UTF-8 sequence
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts = []
+    start = 0
+    limit = 75
+    while len(data) - start > limit:
+        end = start + limit
+        while data[end] & 0xC0 == 0x80: #continuation byte
+            end -= 1
+        parts.append(data[start:end].decode('utf-8'))
+        start = end
+        limit = 74 #the leading space counts
+    parts.append(data[start:].decode('utf-8'))
+    return '\r\n '.join(parts) + '\r\n'
+
+def vevent(event, host):
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:event-{event.id}@{host}',
+        f'DTSTAMP:{format_datetime(event.timestamp)}',
+        f'DTSTART:{format_datetime(event.starts_at)}',
+    ]
+    if event.ends_at is not None and event.ends_at > event.starts_at:
+        lines.append(f'DTEND:{format_datetime(event.ends_at)}')
+    lines.append(f'SUMMARY:{escape_text(event.title or "")}')
+    if event.description:
+        lines.append(f'DESCRIPTION:{escape_text(event.description)}')
+    location = event.location_desc or event.location
+    if location:
+        lines.append(f'LOCATION:{escape_text(location)}')
+    if event.original_event_url:
+        lines.append(f'URL:{event.original_event_url}')
+    if event.original_event_category:
+        categories = [escape_text(c.strip()) for c in event.original_event_category.split(',') if c.strip()]
+        if categories:
+            lines.append(f'CATEGORIES:{",".join(categories)}')
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+def calendar(events, name, host):
+    #yields the calendar as text chunks of about CHUNK_SIZE characters
+    chunk = [fold(line) for line in [
+        'BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH', f'X-WR-CALNAME:{escape_text(name)}']]
+    size = sum(map(len, chunk))
+    for event in events:
+        text = vevent(event, host)
+        chunk.append(text)
+        size += len(text)
+        if size >= CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    chunk.append(fold('END:VCALENDAR'))
+    yield ''.join(chunk)
+
+def etag(hashes, name, host):
+    #hashes: (id, hash) pairs in calendar order
+    sha = hashlib.sha256(f'{VERSION}\n{name}\n{host}\n'.encode('utf-8'))
+    for id, hash in hashes:
+        sha.update(f'{id}:{hash}\n'.encode('utf-8'))
+    return sha.hexdigest()
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+from flask import Response, abort, current_app, request, stream_with_context
+import sqlalchemy as sa
+from app import db
+from app.ics import bp
+from app.ics import icalendar
+from app.models import User, Event, Collection, Feed
+
+#subscribable .ics calendars. A poll costs one query over (id, hash) for the ETag; clients
+#holding that ETag get a 304 and the events themselves are only read, through a server-side
+#cursor, when the calendar changed
+
+def calendar_response(query, name):
+    since = datetime.now(timezone.utc) - timedelta(days=current_app.config['ICS_PAST_DAYS'])
+    query = (query.where(Event.starts_at >= since.replace(tzinfo=None))
+             .order_by(None).order_by(Event.starts_at, Event.id))
+    host = request.host
+    yield_per = current_app.config['ICS_YIELD_PER']
+    tag = icalendar.etag(
+        db.session.execute(query.with_only_columns(Event.id, Event.hash)
+                           .execution_options(yield_per=yield_per)),
+        name, host)
+    if request.if_none_match.contains(tag):
+        response = Response(status=304)
+    else:
+        rows = db.session.execute(
+            query.with_only_columns(*[getattr(Event, column) for column in icalendar.COLUMNS])
+            .execution_options(yield_per=yield_per))
+        response = Response(stream_with_context(icalendar.calendar(rows, name, host)),
+                            mimetype='text/calendar')
+    response.set_etag(tag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['ICS_MAX_AGE']
+    return response
+
+@bp.route('/user/<username>/events.ics')
+def user_calendar(username):
+    user = db.first_or_404(sa.select(User).where(User.username == username))
+    return calendar_response(user.events.select(), user.username)
+
+@bp.route('/user/<username>/following/<token>.ics')
+def following_calendar(username, token):
+    #the timeline is private, so the URL carries the user's calendar token
+    user = db.first_or_404(sa.select(User).where(User.username == username))
+    if not user.check_calendar_token(token):
+        abort(404)
+    return calendar_response(user.following_events(), f'{user.username} (following)')
+
+@bp.route('/collection/<int:id>/events.ics')
+def collection_calendar(id):
+    collection = db.get_or_404(Collection, id)
+    return calendar_response(collection.events.select(), collection.title)
+
+@bp.route('/feeds/<int:id>/events.ics')
+def feed_calendar(id):
+    feed = db.get_or_404(Feed, id)
+    return calendar_response(feed.events.select(), feed.name)
@@ -0,0 +1,114 @@
+import itertools
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from flask import current_app
+from app import db
+from app.models import Event, collections
+import app.location as location
+import app.instrument as instrument
+
+#bulk ingestion of feed records through SQLAlchemy Core. Records are normalized into plain
+#column dicts and written a chunk at a time, so no Event instances are built and the
+#before_flush hook never runs; each row carries the hash set_hash() would have computed.
+#Events missing from a refresh are removed afterwards by delete_missing()
+
+UPSERT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+KEY_COLUMNS = ['feed_id', 'original_event_id']
+#columns a refresh never rewrites on an existing row
+FIXED_COLUMNS = {'id', 'user_id', 'timestamp', *KEY_COLUMNS}
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+def event_row(feed, record, now, locations=None):
+    data = Event.normalize(dict(record), locations)
+    row = {column.name: data.get(column.name) for column in Event.__table__.columns
+           if column.name != 'id'}
+    row['user_id'] = feed.user_id
+    row['feed_id'] = feed.id
+    row['timestamp'] = now
+    row['checked_at'] = now
+    row['geocode_pending'] = bool(row['geocode_pending'])
+    row['geohash'] = Event.location_geohash(row['location_lat'], row['location_lon'])
+    row['hash'] = Event.row_hash(row)
+    return row
+
+def upsert_statement(dialect_name):
+    insert = UPSERT_INSERTS[dialect_name]
+    table = Event.__table__
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=KEY_COLUMNS,
+        set_={name: stmt.excluded[name] for name in table.columns.keys()
+              if name not in FIXED_COLUMNS},
+        where=table.c.hash != stmt.excluded.hash,
+    )
+
+def write_chunk(rows, existing, dialect_name):
+    table = Event.__table__
+    changed = [row for row in rows if existing.get(row['original_event_id']) != row['hash']]
+    if not changed:
+        return
+    if dialect_name in UPSERT_INSERTS:
+        db.session.execute(upsert_statement(dialect_name), changed)
+        return
+    #no native upsert: split into an executemany INSERT and an executemany UPDATE
+    inserts = [row for row in changed if row['original_event_id'] not in existing]
+    updates = [{**row, 'b_feed_id': row['feed_id'], 'b_original_event_id': row['original_event_id']}
+               for row in changed if row['original_event_id'] in existing]
+    if inserts:
+        db.session.execute(sa.insert(table), inserts)
+    if updates:
+        stmt = (
+            sa.update(table)
+            .where(table.c.feed_id == sa.bindparam('b_feed_id'),
+                   table.c.original_event_id == sa.bindparam('b_original_event_id'))
+            .values({name: sa.bindparam(name) for name in table.columns.keys()
+                     if name not in FIXED_COLUMNS})
+        )
+        db.session.execute(stmt, updates)
+
+@instrument.stage('write')
+def delete_missing(feed, seen_ids, chunk_size):
+    table = Event.__table__
+    stored = db.session.execute(
+        sa.select(table.c.id, table.c.original_event_id).where(table.c.feed_id == feed.id))
+    missing = [id for id, original_event_id in stored if original_event_id not in seen_ids]
+    for ids in chunked(missing, chunk_size):
+        db.session.execute(collections.delete().where(collections.c.event_id.in_(ids)))
+        db.session.execute(sa.delete(table).where(table.c.id.in_(ids)))
+    return len(missing)
+
+def upsert_chunk(feed, records, now):
+    #writes one batch of feed records; returns counts of inserted, updated and unchanged rows.
+    #Feed.refresh(bulk=True) streams a feed through this a chunk at a time
+    table = Event.__table__
+    dialect_name = db.session.get_bind().dialect.name
+    summary = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    geocode = not current_app.config['GEOCODE_ASYNC']
+    #each distinct location in the chunk is parsed once
+    locations = location.parse_locations([record.get('location') for record in records], geocode)
+    #last record wins when a chunk repeats an original_event_id
+    rows = list({row['original_event_id']: row for row in
+                 (event_row(feed, record, now, locations) for record in records)}.values())
+    chunk_ids = [row['original_event_id'] for row in rows]
+    with instrument.stage('diff'):
+        existing = dict(db.session.execute(
+            sa.select(table.c.original_event_id, table.c.hash)
+            .where(table.c.feed_id == feed.id, table.c.original_event_id.in_(chunk_ids))).all())
+    with instrument.stage('write'):
+        write_chunk(rows, existing, dialect_name)
+    for row in rows:
+        if row['original_event_id'] not in existing:
+            summary['inserted'] += 1
+        elif existing[row['original_event_id']] != row['hash']:
+            summary['updated'] += 1
+        else:
+            summary['unchanged'] += 1
+    return summary
@@ -0,0 +1,76 @@
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+#per-stage timing for feed refreshes. collect() makes a Timings current for the calling
+#context; stage(name) blocks below it, including in worker threads started through
+#propagate(), add their elapsed time to it. Stages are exclusive: time in a nested stage is
+#not counted again in the enclosing one. Totals are summed over threads, so concurrent
+#fetches can add up to more than the wall time of the refresh
+
+STAGES = ('fetch', 'parse', 'normalize', 'geocode', 'diff', 'write')
+
+_current = contextvars.ContextVar('timings', default=None)
+
+class Timings:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    @contextmanager
+    def stage(self, name):
+        stack = self.local.__dict__.setdefault('stack', [])
+        now = self.clock()
+        if stack: #pause the enclosing stage
+            self.add(stack[-1][0], now - stack[-1][1])
+        stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = self.clock()
+            _, started = stack.pop()
+            self.add(name, now - started)
+            if stack:
+                stack[-1][1] = now
+
+@contextmanager
+def collect():
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def stage(name):
+    #also usable as a decorator; a no-op outside collect()
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.stage(name):
+        yield
+
+def count(name, n=1):
+    timings = _current.get()
+    if timings is not None:
+        timings.count(name, n)
+
+def propagate(fn):
+    #fn wrapped to run in a copy of the caller's context, for use in worker threads
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
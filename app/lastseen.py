@@ -0,0 +1,107 @@
+import atexit
+import threading
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+
+#write-behind buffer for User.last_seen. Requests record the time in memory and a background
+#thread writes everything recorded since the last pass in one bulk UPDATE every
+#LAST_SEEN_FLUSH_INTERVAL seconds, and once more at shutdown. A user is only recorded again
+#after LAST_SEEN_INTERVAL seconds, so most requests do not touch the buffer at all. With a
+#flush interval of 0 the update is written by the request itself
+
+class LastSeenBuffer:
+    def __init__(self, app=None):
+        self.app = None
+        self.granularity = timedelta(seconds=300)
+        self.flush_interval = 5.0
+        self.pending = {} #user id -> last_seen not yet written
+        self.seen = {} #user id -> last_seen recorded within the granularity
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.registered = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.granularity = timedelta(seconds=app.config['LAST_SEEN_INTERVAL'])
+        self.flush_interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+        with self.lock:
+            self.pending.clear()
+            self.seen.clear()
+        if not self.registered:
+            atexit.register(self.shutdown)
+            self.registered = True
+        app.extensions['last_seen'] = self
+
+    def touch(self, user, now=None):
+        #records that user was seen at now; returns whether it will be written
+        now = now or datetime.now(timezone.utc)
+        with self.lock:
+            last = self.seen.get(user.id)
+        if last is None and user.last_seen is not None:
+            last = user.last_seen.replace(tzinfo=timezone.utc)
+        if last is not None and now - last < self.granularity:
+            return False
+        with self.lock:
+            self.pending[user.id] = now
+            self.seen[user.id] = now
+        if self.flush_interval:
+            self.start()
+        else:
+            self.flush()
+        return True
+
+    def flush(self):
+        #writes pending times in one UPDATE; needs an app context. Returns the rows written
+        from app import db
+        from app.models import User
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            horizon = datetime.now(timezone.utc) - self.granularity
+            #older entries no longer hold back a write, so they can go
+            self.seen = {id: seen for id, seen in self.seen.items() if seen > horizon}
+        if not pending:
+            return 0
+        table = User.__table__
+        try:
+            db.session.execute(
+                sa.update(table).where(table.c.id == sa.bindparam('user_id'))
+                .values(last_seen=sa.bindparam('seen')),
+                [{'user_id': id, 'seen': seen} for id, seen in pending.items()])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self.lock: #kept for the next pass, unless a newer time was recorded since
+                for id, seen in pending.items():
+                    self.pending.setdefault(id, seen)
+            raise
+        return len(pending)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name='last-seen', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush_app()
+
+    def flush_app(self):
+        app = self.app
+        with app.app_context():
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception('could not write last_seen')
+
+    def shutdown(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.pending and self.app is not None:
+            self.flush_app()
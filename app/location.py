@@ -1,6 +1,8 @@
 import re
 import urllib.parse as up
-import geopy.geocoders as geocoders
+from app import geocache
+import app.coordinates as coordinates
+import app.instrument as instrument
 
 #alternative:
 #https://geocoding.geo.census.gov/geocoder/Geocoding_Services_API.html
@@ -13,51 +15,72 @@ def is_url(input_string):
     except Exception:
         return False
 
-def get_geocode(location):
-
-    # Regex to match common latitude and longitude formats
-    # Examples: "40.7128, -74.0060", "40 42'46\"N, 74 0'22\"W", "40.7128N, 74.0060W"
-    lat_lon_pattern = r"^(-?\d{1,3}(?:\.\d+)?(?:[NS])?)\s*,\s*(-?\d{1,3}(?:\.\d+)?(?:[EW])?)$"
-    dms_pattern = r"^(-?\d{1,3})\s*(\d{1,2})['’]?\s*(\d{1,2}(?:\.\d+)?)[\"”]?([NS])?,\s*(-?\d{1,3})\s*(\d{1,2})['’]?\s*(\d{1,2}(?:\.\d+)?)[\"”]?([EW])?$"
-
-    if re.match(lat_lon_pattern, location) or re.match(dms_pattern, location):
-        # Additional validation for coordinate ranges
-        try:
-            # Simple check for decimal coordinates
-            parts = location.replace('N', '').replace('S', '').replace('E', '').replace('W', '').split(',')
-            lat = float(parts[0].strip())
-            lon = float(parts[1].strip())
-            if -90 <= lat <= 90 and -180 <= lon <= 180:
-                #return "coordinates"
-                return (lat, lon)
-        except ValueError:
-            # Handle potential errors if it's not a simple decimal format
-            pass
+def get_geocode(location, geocode=True):
+    coords = coordinates.parse_coordinates(location)
+    if coords:
+        return coords
     
     # If not identified as coordinates, assume it's an address
     #return "address"
-    geolocator = geocoders.Nominatim(user_agent="Events Calendar")
+    if not geocode: #caller resolves addresses later (see app.geocoding)
+        return None
+    return geocache.lookup(location, nominatim_geocode)
+
+geolocator = None
+
+def nominatim_geocode(location):
+    global geolocator
+    if geolocator is None:
+        import geopy.geocoders as geocoders #only needed once an address misses the cache
+        geolocator = geocoders.Nominatim(user_agent="Events Calendar")
     result = geolocator.geocode(location)
     if result:
         return (result.latitude, result.longitude)
 
-def parse_location(location):
+GOOGLE_MAPS_HOSTS = {'maps.google.com', 'www.google.com', 'google.com'}
+MAPS_QUERY_KEYS = ('q', 'query', 'll')
+MAPS_AT_COORDS = re.compile(r"/@(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)")
+
+def parse_maps_url(url):
+    #returns the location text a Google Maps link points at, or None
+    if url.netloc not in GOOGLE_MAPS_HOSTS or (url.netloc != 'maps.google.com' and not url.path.startswith('/maps')):
+        return None
+    query_parts = up.parse_qs(url.query)
+    for key in MAPS_QUERY_KEYS:
+        if key in query_parts:
+            return ",".join(query_parts[key])
+    match = MAPS_AT_COORDS.search(url.path)
+    if match:
+        return ",".join(match.groups())
+
+def location_text(location):
+    #the text to geocode for a stored location: the place a maps link points at, or the
+    #location itself
     if is_url(location):
-        url = up.urlparse(location)
-        if url.netloc == "maps.google.com":
-            query_parts = up.parse_qs(url.query)
-            if "q" in query_parts:
-                if isinstance(query_parts['q'], list):
-                    loc = ",".join(query_parts['q'])
-                else:
-                    loc = query_parts['q']
-                coords = get_geocode(loc)
-        else:
-            raise Exception
-    else:
-        coords = get_geocode(location)
-    
-    return coords
+        loc = parse_maps_url(up.urlparse(location))
+        if loc is None:
+            raise ValueError(f"Unsupported location URL '{location}'")
+        return loc
+    return location
+
+@instrument.stage('geocode')
+def parse_location(location, geocode=True):
+    #fast path: maps links usually carry coordinates, which need no geocoding
+    return get_geocode(location_text(location), geocode)
+
+@instrument.stage('geocode')
+def parse_locations(locations, geocode=True):
+    #bulk variant for feed ingestion: {location: coords} for each distinct location. A
+    #location that raises maps to the exception, so callers do not try it again
+    parsed = {}
+    for loc in set(locations):
+        if not loc:
+            continue
+        try:
+            parsed[loc] = parse_location(loc, geocode)
+        except Exception as e:
+            parsed[loc] = e
+    return parsed
 
 if __name__ == "__main__":
     print(parse_location("https://maps.google.com/?q=41.886236488388,-87.834408828447"))
@@ -1,8 +1,10 @@
+from flask import current_app
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, TextAreaField, DateField, TimeField, SelectField
 from wtforms.validators import ValidationError, DataRequired, Length, Optional
 import sqlalchemy as sa
 import datetime
+import functools
 import json
 import pytz
 #from flask_babel import _, lazy_gettext as _l
@@ -29,14 +31,19 @@ class EditProfileForm(FlaskForm):
 class EmptyForm(FlaskForm):
     submit = SubmitField('Submit')
 
+@functools.cache
+def timezone_choices():
+    #built on first use instead of at import
+    return [(tz, tz) for tz in pytz.all_timezones]
+
 class EventForm(FlaskForm):
     title = TextAreaField('Title of event', validators=[
         DataRequired(), Length(min=1, max=140)])
     description = TextAreaField('Description of event', validators=[
         DataRequired(), Length(min=0)])
-    timezone = SelectField('Timezone', choices=[(tz, tz) for tz in pytz.all_timezones], validators=[DataRequired()])
-    starts_at_date = DateField("Start Date", default=datetime.datetime.today(), validators=[DataRequired()])
-    starts_at_time = TimeField("Start time", format='%H:%M', default=datetime.datetime.now(), validators=[Optional()])
+    timezone = SelectField('Timezone', choices=timezone_choices, validators=[DataRequired()])
+    starts_at_date = DateField("Start Date", default=datetime.datetime.today, validators=[DataRequired()])
+    starts_at_time = TimeField("Start time", format='%H:%M', default=datetime.datetime.now, validators=[Optional()])
     ends_at_date = DateField("End Date", validators=[Optional()])
     ends_at_time = TimeField("End time", format='%H:%M', validators=[Optional()])
     #starts_at = DateTimeLocalField("Starts At", default=datetime.datetime.now()) #format='%m/%d/%YT%H:%M', 
@@ -55,7 +62,8 @@ class EventForm(FlaskForm):
     def validate_location(self, field):
         if field.data:
             try:
-                coords = location.parse_location(field.data)
+                coords = location.parse_location(
+                    field.data, not current_app.config['GEOCODE_ASYNC'])
                 self.coords = coords  # Store the parsed result as a new attribute
             except Exception as e:
                 raise ValidationError(f"Error parsing Location: {e}")
@@ -1,18 +1,40 @@
-from flask import render_template, flash, redirect, url_for, request, current_app
+from flask import render_template, flash, redirect, url_for, request, current_app, abort
 from flask_login import current_user, login_required
-from app import db
+from app import db, lastseen
 from app.main.forms import EditProfileForm, EmptyForm, EventForm
 from app.models import User, Event
 import sqlalchemy as sa
 from datetime import datetime, timezone
 from app.main import bp
 from app.time import local_to_utc
+from app.pagination import keyset_paginate, InvalidCursor
 
 @bp.before_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.now(timezone.utc)
-        db.session.commit()
+        lastseen.touch(current_user)
+
+def paginate_events(query, columns, endpoint, **kwargs):
+    #returns (events, next_url, prev_url); cursor pagination on columns unless the request
+    #asks for an offset ?page=
+    per_page = current_app.config['POSTS_PER_PAGE']
+    if 'page' in request.args:
+        page = request.args.get('page', 1, type=int)
+        events = db.paginate(query, page=page, per_page=per_page, error_out=False)
+        next_url = url_for(endpoint, page=events.next_num, **kwargs) \
+            if events.has_next else None
+        prev_url = url_for(endpoint, page=events.prev_num, **kwargs) \
+            if events.has_prev else None
+        return events.items, next_url, prev_url
+    try:
+        events = keyset_paginate(query, columns, per_page, request.args.get('cursor'))
+    except InvalidCursor:
+        abort(400)
+    next_url = url_for(endpoint, cursor=events.next_cursor, **kwargs) \
+        if events.next_cursor else None
+    prev_url = url_for(endpoint, cursor=events.prev_cursor, **kwargs) \
+        if events.prev_cursor else None
+    return events.items, next_url, prev_url
 
 @bp.route('/feed', methods=['GET', 'POST'])
 @login_required
@@ -47,33 +69,28 @@ def feed():
         db.session.commit()
         flash('Your event is now live!')
         return redirect(url_for('main.feed'))
-    page = request.args.get('page', 1, type=int)
-    events = db.paginate(current_user.following_events(), page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'], error_out=False)
-    next_url = url_for('main.feed', page=events.next_num) \
-        if events.has_next else None
-    prev_url = url_for('main.feed', page=events.prev_num) \
-        if events.has_prev else None
+    events, next_url, prev_url = paginate_events(
+        current_user.following_events(), (Event.starts_at, Event.id), 'main.feed')
     return render_template('feed.html', title='Feed', form=form,
-                        events=events.items, next_url=next_url,
+                        events=events, next_url=next_url,
                         prev_url=prev_url)
 
 @bp.route('/user/<username>')
 #@login_required
 def user(username):
     user = db.first_or_404(sa.select(User).where(User.username == username))
-    page = request.args.get('page', 1, type=int)
     query = user.events.select().order_by(Event.timestamp.asc())
-    events = db.paginate(query, page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'],
-                        error_out=False)
-    next_url = url_for('main.user', username=user.username, page=events.next_num) \
-        if events.has_next else None
-    prev_url = url_for('main.user', username=user.username, page=events.prev_num) \
-        if events.has_prev else None
+    events, next_url, prev_url = paginate_events(
+        query, (Event.timestamp, Event.id), 'main.user', username=user.username)
     form = EmptyForm()
-    return render_template('user.html', user=user, events=events.items,
-                           next_url=next_url, prev_url=prev_url, form=form)
+    calendar_url = None
+    if user == current_user:
+        calendar_url = url_for('ics.following_calendar', username=user.username,
+                               token=user.get_calendar_token(), _external=True)
+        db.session.commit()
+    return render_template('user.html', user=user, events=events,
+                           next_url=next_url, prev_url=prev_url, form=form,
+                           calendar_url=calendar_url)
 
 
 @bp.route('/edit_profile', methods=['GET', 'POST'])
@@ -138,12 +155,6 @@ def unfollow(username):
 @bp.route('/explore', methods=['GET'])
 #@login_required
 def explore():
-    page = request.args.get('page', 1, type=int)
     query = sa.select(Event).order_by(Event.starts_at.asc())
-    events = db.paginate(query, page=page,
-                        per_page=current_app.config['POSTS_PER_PAGE'], error_out=False)
-    next_url = url_for('main.explore', page=events.next_num) \
-        if events.has_next else None
-    prev_url = url_for('main.explore', page=events.prev_num) \
-        if events.has_prev else None
-    return render_template("feed.html", title='Explore', events=events.items, next_url=next_url, prev_url=prev_url)
+    events, next_url, prev_url = paginate_events(query, (Event.starts_at, Event.id), 'main.explore')
+    return render_template("feed.html", title='Explore', events=events, next_url=next_url, prev_url=prev_url)
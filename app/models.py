@@ -3,8 +3,13 @@ from datetime import datetime, timezone, timedelta
 from typing import Optional
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from app import db, login
+from app import db, login, authcache
 import app.location as location
+import app.reconcile as reconcile
+import app.sources as sources
+import app.instrument as instrument
+import app.geohash as geohash
+from app.fingerprint import Fingerprint
 from app.time import local_to_utc
 from flask_login import UserMixin
 from hashlib import md5
@@ -12,46 +17,65 @@ from time import time
 import jwt
 from flask import current_app, url_for
 import secrets
-import hashlib
-import json
-import feeds
-
-def ordered(obj):
-    if isinstance(obj, dict):
-        return sorted((k, ordered(v)) for k, v in obj.items())
-    if isinstance(obj, list):
-        return sorted(ordered(x) for x in obj)
-    else:
-        return obj
 
 def before_flush_listener(session, flust_context, instances):
     #print("before_flush event listener called")
-    run_global_updates(session.dirty)
+    run_global_updates(session.dirty, changed_only=True)
     run_global_updates(session.new)
 
 
-def run_global_updates(records):
+def hashed_fields_changed(obj, fields):
+    #attribute history is already tracked by the session, so this costs no extra queries
+    attrs = sa.inspect(obj).attrs
+    return any(attrs[field].history.has_changes() for field in fields)
+
+def run_global_updates(records, changed_only=False):
     for obj in records:
         # if hasattr(obj, 'update_timestamp'):
         #     obj.update_timestamp()
         #     print(f"Updating timestamp for {obj}")
-        if callable(getattr(obj, 'set_hash', None)):
-            obj.set_hash()
-            #print(f"Setting hash for {obj}")
+        fields = getattr(type(obj), 'geohash_fields', None)
+        if fields and (not changed_only or hashed_fields_changed(obj, fields)):
+            obj.set_geohash()
+        fields = getattr(type(obj), 'hash_fields', None)
+        if not fields: #type defines no hash
+            continue
+        if changed_only and obj.hash is not None and not hashed_fields_changed(obj, fields):
+            continue
+        obj.set_hash()
+        #print(f"Setting hash for {obj}")
 
 sa.event.listen(db.session, 'before_flush', before_flush_listener)
 
-def create_hash(dict):
-    dict.pop('id', None)
-    dict.pop('timestamp', None)
-    dict.pop('hash', None)
-    ordered_dict = ordered(dict)
-    to_hash = json.dumps(ordered_dict)
-    return hashlib.sha256(to_hash.encode('utf-8')).hexdigest()
+def after_flush_listener(session, flush_context):
+    #written users are dropped from the auth cache, and dropped again once the write commits:
+    #another request may cache the old row in between
+    for obj in [*session.dirty, *session.deleted]:
+        if isinstance(obj, User):
+            authcache.evict(obj.id)
+            session.info.setdefault('evict_users', set()).add(obj.id)
+
+def after_commit_listener(session):
+    for id in session.info.pop('evict_users', ()):
+        authcache.evict(id)
+
+def after_rollback_listener(session):
+    session.info.pop('evict_users', None)
+
+sa.event.listen(db.session, 'after_flush', after_flush_listener)
+sa.event.listen(db.session, 'after_commit', after_commit_listener)
+sa.event.listen(db.session, 'after_rollback', after_rollback_listener)
 
 @login.user_loader
 def load_user(id):
-    return db.session.get(User, int(id))
+    user = authcache.get(int(id))
+    if user is not None:
+        return db.session.merge(user, load=False)
+    generation = authcache.generation
+    user = db.session.get(User, int(id))
+    if user is not None:
+        authcache.set(user, generation)
+    return user
 
 followers = sa.Table(
     'followers',
@@ -59,7 +83,9 @@ followers = sa.Table(
     sa.Column('follower_id', sa.Integer, sa.ForeignKey('user.id'),
               primary_key=True),
     sa.Column('followed_id', sa.Integer, sa.ForeignKey('user.id'),
-              primary_key=True)
+              primary_key=True),
+    #the primary key serves who a user follows; this serves who follows a user
+    sa.Index('ix_followers_followed_id', 'followed_id', 'follower_id'),
 )
 
 collections = sa.Table(
@@ -101,6 +127,31 @@ class PaginatedAPIMixin(object):
         }
         return data
 
+    @staticmethod
+    def to_cursor_dict(query, columns, per_page, cursor, endpoint, count=False, **kwargs):
+        #keyset counterpart of to_collection_dict; see app.pagination
+        from app.pagination import keyset_paginate
+        resources = keyset_paginate(query, columns, per_page, cursor, count)
+        data = {
+            'items': [item.to_dict() for item in resources.items],
+            '_meta': {
+                'per_page': per_page,
+                'cursor': cursor,
+                'next_cursor': resources.next_cursor,
+                'prev_cursor': resources.prev_cursor,
+            },
+            '_links': {
+                'self': url_for(endpoint, cursor=cursor, per_page=per_page, **kwargs),
+                'next': url_for(endpoint, cursor=resources.next_cursor, per_page=per_page,
+                                **kwargs) if resources.next_cursor else None,
+                'prev': url_for(endpoint, cursor=resources.prev_cursor, per_page=per_page,
+                                **kwargs) if resources.prev_cursor else None
+            }
+        }
+        if count:
+            data['_meta']['total_items'] = resources.total
+        return data
+
 class User(PaginatedAPIMixin, UserMixin, db.Model):
     #add profile_url to retrieve Org logo
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
@@ -114,6 +165,8 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         default=lambda: datetime.now(timezone.utc))
     token: so.Mapped[Optional[str]] = so.mapped_column(sa.String(32), index=True, unique=True)
     token_expiration: so.Mapped[Optional[datetime]]
+    #secret part of the following.ics URL; calendar clients cannot log in
+    calendar_token: so.Mapped[Optional[str]] = so.mapped_column(sa.String(32), unique=True)
     account_type: so.Mapped[str] = so.mapped_column(sa.String(16), index=True)
     url: so.Mapped[Optional[str]] = so.mapped_column(sa.String(), nullable=True)
 
@@ -138,6 +191,8 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     def to_dict(self):
         data = {}
         for column in self.__table__.columns:
+            if column.name == 'calendar_token':
+                continue
             col_val = getattr(self, column.name)
             if column.name in ['last_seen', 'token_expiration']:
                 data[column.name] = col_val.replace(tzinfo=timezone.utc).isoformat() if col_val else None
@@ -183,20 +238,18 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return db.session.scalar(query)
     
     def following_events(self):
-        Source = so.aliased(User)
-        Follower = so.aliased(User)
+        #own events and events of followed users. The owners are an IN list over a UNION, so
+        #the timeline is index range scans on (user_id, starts_at) instead of a join through
+        #followers with an OR and a GROUP BY
+        owners = sa.union(
+            sa.select(sa.literal(self.id)),
+            sa.select(followers.c.followed_id).where(followers.c.follower_id == self.id))
         return (
             sa.select(Event)
-            .join(Event.owner.of_type(Source))
-            .join(Source.followers.of_type(Follower), isouter=True)
-            .where(sa.or_(
-                Follower.id == self.id,
-                Source.id == self.id,
-            ))
-            .group_by(Event)
-            .order_by(Event.starts_at.asc())
+            .where(Event.user_id.in_(owners))
+            .order_by(Event.starts_at.asc(), Event.id.asc())
         )
-        
+
     def get_reset_password_token(self, expires_in=600):
         return jwt.encode(
             {'reset_password': self.id, 'exp': time() + expires_in},
@@ -221,13 +274,30 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         db.session.add(self)
         return self.token
 
+    def get_calendar_token(self):
+        if self.calendar_token is None:
+            self.calendar_token = secrets.token_hex(16)
+            db.session.add(self)
+        return self.calendar_token
+
+    def check_calendar_token(self, token):
+        return self.calendar_token is not None and secrets.compare_digest(self.calendar_token, token)
+
     def revoke_token(self):
         self.token_expiration = datetime.now(timezone.utc) - timedelta(
             seconds=1)
+        authcache.evict(self.id)
 
     @staticmethod
     def check_token(token):
-        user = db.session.scalar(sa.select(User).where(User.token == token))
+        user = authcache.get_token(token)
+        if user is not None:
+            user = db.session.merge(user, load=False)
+        else:
+            generation = authcache.generation
+            user = db.session.scalar(sa.select(User).where(User.token == token))
+            if user is not None:
+                authcache.set(user, generation)
         if user is None or user.token_expiration.replace(
                 tzinfo=timezone.utc) < datetime.now(timezone.utc):
             return None
@@ -278,11 +348,15 @@ class Feed(PaginatedAPIMixin, db.Model):
     token_expiration: so.Mapped[Optional[datetime]]
     last_refresh: so.Mapped[datetime] = so.mapped_column(
         index=True, default=lambda: datetime.now(timezone.utc))
+    #seconds between scheduled refreshes; FEED_REFRESH_INTERVAL when not set
+    refresh_interval: so.Mapped[Optional[int]]
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
                                                index=True)
     owner: so.Mapped[User] = so.relationship(back_populates='feeds')
     events: so.WriteOnlyMapped['Event'] = so.relationship(
         back_populates='feed')
+    runs: so.WriteOnlyMapped['FeedRun'] = so.relationship(
+        back_populates='feed', passive_deletes=True)
     
     def to_dict(self):
         data = {}
@@ -299,8 +373,8 @@ class Feed(PaginatedAPIMixin, db.Model):
             val = data[field]
             setattr(self, field, val)
 
-    def refresh(self):
-        feed_class = getattr(feeds, self.type, None)
+    def refresh(self, bulk=False, incremental=False):
+        feed_class = sources.get_source(self.type)
         if feed_class is not None:
             feed_instance = feed_class()
         else:
@@ -311,31 +385,76 @@ class Feed(PaginatedAPIMixin, db.Model):
         #apply data map (i.e. field name changes)
             #load as class based on self.type e.g. "Openlands", which has methods and field map for transforming resource for use by this app
         #query all existing events in current feed [in future?]
-        events = feed_instance.get()
-        #print(events)
-        current_query = self.events.select().where(Event.feed_id == self.id)
-        current_events = db.session.scalars(current_query).all()
-        found_events = []
-        for current_event in current_events:
-            found_event = None
-            for event in events:
-                if current_event.original_event_id == event['original_event_id']:
-                    if not current_event.check_hash(event):
-                        found_event = event
-                        found_events.append(found_event)
-                        events.remove(event)
-                        break
-            if found_event:
+        from app import ingest
+        now = datetime.now(timezone.utc)
+        plan = None
+        if incremental and hasattr(feed_instance, 'list_event_ids'):
+            #only new listing ids and stored ones due for revalidation are fetched
+            with instrument.stage('diff'):
+                plan = self.plan_refresh(feed_instance, now)
+            events = feed_instance.iter_events(event_ids=plan.fetch)
+        else:
+            events = feed_instance.iter_events()
+        #events are streamed from the source and written a batch at a time, so memory is bounded
+        #by the batch size and writing starts before the source has been read to the end
+        if bulk:
+            write, size = ingest.upsert_chunk, current_app.config['FEED_BULK_CHUNK_SIZE']
+        else:
+            write, size = Feed.write_batch, current_app.config['FEED_BATCH_SIZE']
+        summary = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        seen_ids = set(plan.keep) if plan else set()
+        for batch in ingest.chunked(events, size):
+            for key, count in write(self, batch, now).items():
+                summary[key] += count
+            batch_ids = [event['original_event_id'] for event in batch]
+            seen_ids.update(batch_ids)
+            if plan:
+                with instrument.stage('write'):
+                    db.session.execute(
+                        sa.update(Event)
+                        .where(Event.feed_id == self.id, Event.original_event_id.in_(batch_ids))
+                        .values(checked_at=now))
+        #unchanged events are left alone; vanished ones go in set-based DELETEs
+        summary['deleted'] += ingest.delete_missing(self, seen_ids, size)
+        if plan:
+            summary.update(fetched=len(plan.fetch), new=plan.new,
+                           revalidated=plan.revalidated, skipped=len(plan.keep))
+        self.last_refresh = now
+        with instrument.stage('write'):
+            db.session.commit()
+        current_app.logger.info(f'Refreshed {self}{" (bulk)" if bulk else ""}: {summary}')
+        return summary
+
+    def write_batch(self, records, now):
+        #ORM counterpart of ingest.upsert_chunk: diffs records against their stored events
+        ids = [record['original_event_id'] for record in records]
+        with instrument.stage('diff'):
+            current_events = db.session.scalars(
+                self.events.select().where(Event.original_event_id.in_(ids))).all()
+            diff = reconcile.diff_events(current_events, records)
+        with instrument.stage('write'):
+            for current_event, event in diff.updates:
                 current_event.from_dict(event)
-            else:
-                db.session.delete(current_event)
-        for event in events: #remaining events are new
-            e1 = Event(owner=self.owner, feed=self)
-            e1.from_dict(event)
-            db.session.add(e1)
-        self.last_refresh = datetime.now(timezone.utc)
-        db.session.commit()
+            for event in diff.inserts:
+                e1 = Event(owner=self.owner, feed=self, checked_at=now)
+                e1.from_dict(event)
+                db.session.add(e1)
+            db.session.flush()
+        return diff.summary()
+
+    def plan_refresh(self, feed_instance, now):
+        stored = db.session.execute(
+            sa.select(Event.original_event_id, Event.checked_at)
+            .where(Event.feed_id == self.id)).all()
+        return reconcile.plan_refresh(
+            stored, feed_instance.list_event_ids(), feed_instance.base_event_id,
+            now - timedelta(seconds=current_app.config['FEED_REVALIDATE_AFTER']),
+            current_app.config['FEED_REVALIDATE_BATCH'])
     
+    def next_refresh(self):
+        interval = self.refresh_interval or current_app.config['FEED_REFRESH_INTERVAL']
+        return self.last_refresh.replace(tzinfo=timezone.utc) + timedelta(seconds=interval)
+
     def __repr__(self):
         return f'<Feed {self.id} {self.name} {self.description}>'
     
@@ -357,41 +476,77 @@ class Event(PaginatedAPIMixin, db.Model):
     timestamp: so.Mapped[datetime] = so.mapped_column(
         index=True, default=lambda: datetime.now(timezone.utc))
     hash: so.Mapped[str] = so.mapped_column(sa.String(64), nullable=True)
-
-    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
-                                               index=True)
+    geocode_pending: so.Mapped[bool] = so.mapped_column(default=False, index=True)
+    #when a feed refresh last fetched this event's source details; drives incremental refreshes
+    checked_at: so.Mapped[Optional[datetime]] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc))
+    #geohash of location_lat/location_lon, kept in step on flush; see app.geohash
+    geohash: so.Mapped[Optional[str]] = so.mapped_column(sa.String(12), index=True)
+
+    __table_args__ = (
+        #one row per source event within a feed; the key bulk upserts resolve conflicts on
+        sa.UniqueConstraint('feed_id', 'original_event_id'),
+        #keyset pagination and time-window filters on /api/events
+        sa.Index('ix_event_starts_at_id', 'starts_at', 'id'),
+        #bounding-box filters: a range on latitude, then longitude within it
+        sa.Index('ix_event_location_lat_lon', 'location_lat', 'location_lon'),
+        #follow timelines: each owner's events in starts_at order
+        sa.Index('ix_event_user_id_starts_at', 'user_id', 'starts_at', 'id'),
+        #an owner's events in the order they were posted, for the user page
+        sa.Index('ix_event_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+    )
+
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     owner: so.Mapped[User] = so.relationship(back_populates='events')
 
-    feed_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey(Feed.id), index=True)
+    #lookups by feed use the (feed_id, original_event_id) unique constraint
+    feed_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey(Feed.id))
     feed: so.Mapped[Feed] = so.relationship(back_populates='events')
 
     in_collection: so.WriteOnlyMapped['Collection'] = so.relationship(
         secondary=collections, 
         primaryjoin=("collections.c.event_id == Event.id"),
         secondaryjoin=("collections.c.collection_id == Collection.id"),
-        back_populates='events')
+        back_populates='events', passive_deletes=True)
     
+    #source content of an event; derived (location_lat/lon) and bookkeeping columns are left out
+    #so a stored event and the feed record it came from hash the same
+    hash_fields = ('title', 'description', 'starts_at', 'ends_at', 'location', 'location_desc',
+                   'location_geojson', 'original_event_id', 'original_event_url',
+                   'original_event_category')
+
+    content_fingerprint = Fingerprint(hash_fields, datetime_fields=('starts_at', 'ends_at'))
+
     def set_hash(self):
-        dict = self.to_dict()
-        #print(f'Start dict: {dict}')
-        self.hash = create_hash(dict)
+        self.hash = Event.content_fingerprint.of_instance(self)
+
+    geohash_fields = ('location_lat', 'location_lon')
+
+    @staticmethod
+    def location_geohash(lat, lon):
+        return None if lat is None or lon is None else geohash.encode(lat, lon)
+
+    def set_geohash(self):
+        self.geohash = Event.location_geohash(self.location_lat, self.location_lon)
     
     def check_hash(self, dict):
-        hash = create_hash(dict)
-        #print(f'End dict: {dict}')
-        return hash == self.hash
+        return Event.content_fingerprint.of_mapping(dict) == self.hash
     
     def to_dict(self):
         data = {}
         for column in self.__table__.columns:
             col_val = getattr(self, column.name)
-            if column.name in ['starts_at', 'ends_at', 'timestamp']:
+            if column.name in ['starts_at', 'ends_at', 'timestamp', 'checked_at']:
                 data[column.name] = col_val.replace(tzinfo=timezone.utc).isoformat() if col_val else None
             else:
                 data[column.name] = col_val
         return data
     
-    def from_dict(self, data):
+    @staticmethod
+    @instrument.stage('normalize')
+    def normalize(data, locations=None):
+        #converts form, API and feed payloads into column values; locations optionally maps
+        #location text to coordinates already parsed by location.parse_locations
         if 'starts_at_date' in data: #data is from web form
             if not data['starts_at_time']:
                 data['starts_at_time'] = datetime.min.time()
@@ -407,25 +562,47 @@ class Event(PaginatedAPIMixin, db.Model):
             data.pop('ends_at_time')
             data.pop('timezone')
         
-        if 'location' in data:
+        if 'location' in data: #location text is kept so it can be hashed and re-geocoded
+            geocode = not current_app.config['GEOCODE_ASYNC']
             try:
-                coords = location.parse_location(data['location'])
-                data['location_lat'] = list(coords)[0]
-                data['location_lon'] = list(coords)[1]
-                data.pop('location')
+                if locations is not None and data['location'] in locations:
+                    coords = locations[data['location']]
+                    if isinstance(coords, Exception):
+                        raise coords
+                else:
+                    coords = location.parse_location(data['location'], geocode)
+                if coords is None and not geocode and data['location']:
+                    #address is resolved later by the geocoding queue
+                    data['location_lat'] = None
+                    data['location_lon'] = None
+                    data['geocode_pending'] = True
+                else:
+                    data['location_lat'] = list(coords)[0]
+                    data['location_lon'] = list(coords)[1]
+                    data['geocode_pending'] = False
             except Exception as e:
                 #raise ValidationError(f"Location '{data['location']}'could not be parsed")
-                pass #unparsed location will be added as 'location'
+                pass #unparsed location is kept as 'location' without coordinates
         if 'coords' in data:
             data['location_lat'] = list(data['coords'])[0]
             data['location_lon'] = list(data['coords'])[1]
             data.pop('coords')
 
+        for field in ['starts_at', 'ends_at']:
+            val = data.get(field)
+            if field in data and not isinstance(val, datetime):
+                data[field] = datetime.fromisoformat(val) if val else None
+        return data
+
+    @staticmethod
+    def row_hash(row):
+        #same digest set_hash() produces, computed from a plain column dict
+        return Event.content_fingerprint.of_mapping(row)
+
+    def from_dict(self, data):
+        data = Event.normalize(data)
         for field in data:
-            val = data[field]
-            if field in ['starts_at', 'ends_at'] and not isinstance(val, datetime):
-                val = datetime.fromisoformat(val) if val else None
-            setattr(self, field, val)
+            setattr(self, field, data[field])
     
     def add_to_collection(self, collection):
         if not self.is_in_collection(collection):
@@ -442,6 +619,8 @@ class Event(PaginatedAPIMixin, db.Model):
     def __repr__(self):
         return f'<Event {self.id} {self.title} {self.starts_at} {self.ends_at} {self.location_lat} {self.location_lon}>'
     
+Event.content_fingerprint.track(Event)
+
 class Collection(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     title: so.Mapped[str] = so.mapped_column(sa.String(140))
@@ -472,3 +651,52 @@ class Collection(db.Model):
 
     def __repr__(self):
         return '<Collection {}>'.format(self.title)
+
+class FeedRun(db.Model):
+    #one recorded refresh of a feed, successful or not
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    feed_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Feed.id, ondelete='CASCADE'),
+                                               index=True)
+    feed: so.Mapped[Feed] = so.relationship(back_populates='runs')
+    started_at: so.Mapped[datetime] = so.mapped_column(
+        index=True, default=lambda: datetime.now(timezone.utc))
+    duration: so.Mapped[Optional[float]] #seconds
+    status: so.Mapped[str] = so.mapped_column(sa.String(16)) #'ok' or 'failed'
+    error: so.Mapped[Optional[str]] = so.mapped_column(sa.String())
+    inserted: so.Mapped[int] = so.mapped_column(default=0)
+    updated: so.Mapped[int] = so.mapped_column(default=0)
+    deleted: so.Mapped[int] = so.mapped_column(default=0)
+    unchanged: so.Mapped[int] = so.mapped_column(default=0)
+    bytes_downloaded: so.Mapped[int] = so.mapped_column(default=0)
+    #HTTP requests sent, cache entries reused without a request, and 304 responses
+    http_requests: so.Mapped[int] = so.mapped_column(default=0)
+    http_fresh: so.Mapped[int] = so.mapped_column(default=0)
+    http_not_modified: so.Mapped[int] = so.mapped_column(default=0)
+    #seconds spent in each stage, summed over threads (see app.instrument)
+    fetch_seconds: so.Mapped[Optional[float]]
+    parse_seconds: so.Mapped[Optional[float]]
+    normalize_seconds: so.Mapped[Optional[float]]
+    geocode_seconds: so.Mapped[Optional[float]]
+    diff_seconds: so.Mapped[Optional[float]]
+    write_seconds: so.Mapped[Optional[float]]
+
+    def record_timings(self, timings):
+        for stage in instrument.STAGES:
+            setattr(self, f'{stage}_seconds', timings.stages[stage])
+        self.bytes_downloaded = timings.counters['http_bytes']
+        for stat in ['requests', 'fresh', 'not_modified']:
+            setattr(self, f'http_{stat}', timings.counters[f'http_{stat}'])
+
+    def to_dict(self):
+        data = {}
+        for column in self.__table__.columns:
+            col_val = getattr(self, column.name)
+            if column.name in ['started_at']:
+                data[column.name] = col_val.replace(tzinfo=timezone.utc).isoformat() if col_val else None
+            else:
+                data[column.name] = col_val
+        return data
+
+    def __repr__(self):
+        return f'<FeedRun {self.id} feed={self.feed_id} {self.status} {self.duration}>'
+
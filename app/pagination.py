@@ -0,0 +1,72 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime
+import sqlalchemy as sa
+from app import db
+
+#keyset (cursor) pagination. Rows are ordered by a unique key such as (starts_at, id) and a
+#page is fetched with WHERE key > last key seen, so every page costs the same index range scan
+#however deep it is, and no COUNT(*) runs unless asked for. Cursors are opaque url-safe
+#tokens holding the direction and the key of the row to continue from
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(direction, values):
+    payload = [direction, [v.isoformat() if isinstance(v, datetime) else v for v in values]]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, columns):
+    #returns (direction, key values typed like columns)
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        direction, values = payload
+        if direction not in ('next', 'prev') or len(values) != len(columns):
+            raise ValueError(cursor)
+        return direction, tuple(datetime.fromisoformat(value) if column.type.python_type is datetime
+                                else column.type.python_type(value)
+                                for column, value in zip(columns, values))
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError) as e:
+        raise InvalidCursor(f'invalid cursor {cursor!r}') from e
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str = None
+    prev_cursor: str = None
+    total: int = None #only when requested
+
+def keyset_paginate(query, columns, per_page, cursor=None, count=False):
+    #query must not be ordered already; columns is the unique key, e.g. (Event.starts_at, Event.id)
+    direction, key = decode_cursor(cursor, columns) if cursor else ('next', None)
+    forward = direction == 'next'
+    page_query = query.order_by(None).order_by(
+        *[column.asc() if forward else column.desc() for column in columns])
+    if key is not None:
+        row = sa.tuple_(*columns)
+        page_query = page_query.where(row > sa.tuple_(*key) if forward else row < sa.tuple_(*key))
+    items = db.session.scalars(page_query.limit(per_page + 1)).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if not forward:
+        items.reverse()
+    def key_of(item):
+        return [getattr(item, column.key) for column in columns]
+    page = KeysetPage(items)
+    #going forward there are earlier rows iff the page started from a cursor; going backward,
+    #the page the cursor came from follows this one
+    has_next = more if forward else key is not None
+    has_prev = key is not None if forward else more
+    if items:
+        first, last = key_of(items[0]), key_of(items[-1])
+    else: #nothing left past the cursor; continue from the cursor itself
+        first = last = key
+    if has_next:
+        page.next_cursor = encode_cursor('next', last)
+    if has_prev:
+        page.prev_cursor = encode_cursor('prev', first)
+    if count:
+        page.total = db.session.scalar(sa.select(sa.func.count()).select_from(query.order_by(None).subquery()))
+    return page
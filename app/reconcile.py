@@ -0,0 +1,87 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+#diffs the events stored for a feed against a freshly fetched list of feed records.
+#both sides are indexed by original_event_id so reconciliation is a single linear pass
+
+@dataclass
+class FeedDiff:
+    inserts: list = field(default_factory=list)    #incoming records with no stored event
+    updates: list = field(default_factory=list)    #(stored event, incoming record) pairs whose content changed
+    deletes: list = field(default_factory=list)    #stored events no longer present in the feed
+    unchanged: list = field(default_factory=list)  #stored events whose content matches the incoming record
+
+    def summary(self):
+        return {
+            'inserted': len(self.inserts),
+            'updated': len(self.updates),
+            'deleted': len(self.deletes),
+            'unchanged': len(self.unchanged),
+        }
+
+def index_by_original_id(items, key):
+    #last occurrence wins, matching the order feeds emit records in
+    index = {}
+    duplicates = []
+    for item in items:
+        item_id = key(item)
+        if item_id in index:
+            duplicates.append(index[item_id])
+        index[item_id] = item
+    return index, duplicates
+
+def diff_events(current_events, incoming):
+    diff = FeedDiff()
+    stored, stale = index_by_original_id(current_events, lambda e: e.original_event_id)
+    fresh, _ = index_by_original_id(incoming, lambda r: r['original_event_id'])
+    #stored rows sharing an original_event_id can never be matched again
+    diff.deletes.extend(stale)
+    for original_event_id, record in fresh.items():
+        current_event = stored.pop(original_event_id, None)
+        if current_event is None:
+            diff.inserts.append(record)
+        elif current_event.check_hash(record):
+            diff.unchanged.append(current_event)
+        else:
+            diff.updates.append((current_event, record))
+    diff.deletes.extend(stored.values()) #anything left was not in the feed
+    return diff
+
+@dataclass
+class RefreshPlan:
+    fetch: list = field(default_factory=list)   #listed ids whose details must be fetched
+    keep: set = field(default_factory=set)      #original_event_ids of stored events left as they are
+    new: int = 0                                #how many of fetch have no stored events
+    revalidated: int = 0                        #how many of fetch are stored events due for a re-check
+
+def plan_refresh(stored, listed_ids, base_id, stale_before, revalidate_limit):
+    #stored is (original_event_id, checked_at) pairs; listed_ids the ids on the feed's listing
+    #page; base_id maps an original_event_id to its listing id. Listed ids with no stored event
+    #are fetched, as are up to revalidate_limit stored ids last checked before stale_before
+    #(oldest first). Stored events whose id left the listing are neither fetched nor kept
+    groups = {}
+    for original_event_id, checked_at in stored:
+        if checked_at is not None and checked_at.tzinfo is None:
+            checked_at = checked_at.replace(tzinfo=timezone.utc)
+        groups.setdefault(base_id(original_event_id), []).append((original_event_id, checked_at))
+    plan = RefreshPlan()
+    listed = list(dict.fromkeys(listed_ids))
+    due = []
+    for listed_id in listed:
+        events = groups.get(listed_id)
+        if events is None:
+            plan.fetch.append(listed_id)
+            plan.new += 1
+            continue
+        checks = [checked_at for _, checked_at in events]
+        oldest = None if None in checks else min(checks)
+        if oldest is None or oldest < stale_before:
+            due.append((oldest or datetime.min.replace(tzinfo=timezone.utc), listed_id))
+    due.sort(key=lambda item: item[0])
+    revalidate = {listed_id for _, listed_id in due[:revalidate_limit]}
+    plan.fetch.extend(listed_id for listed_id in listed if listed_id in revalidate)
+    plan.revalidated = len(revalidate)
+    for listed_id in listed:
+        if listed_id in groups and listed_id not in revalidate:
+            plan.keep.update(original_event_id for original_event_id, _ in groups[listed_id])
+    return plan
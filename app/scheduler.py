@@ -0,0 +1,132 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.models import Feed, FeedRun
+import app.instrument as instrument
+
+#background feed refreshes. Feeds are due once last_refresh plus their refresh_interval has
+#passed; due feeds are refreshed in a worker pool, at most FEED_SOURCE_CONCURRENCY at a time
+#per feed type so one source's site is not flooded, each after a random delay of up to
+#FEED_REFRESH_JITTER seconds. Every refresh is recorded as a FeedRun with per-stage timings
+
+def due_feeds(now=None):
+    #the due check runs in the database with one last_refresh cutoff per distinct
+    #refresh_interval, so feeds that are not due are never loaded. A missing or zero interval
+    #means FEED_REFRESH_INTERVAL, as in Feed.next_refresh()
+    now = (now or datetime.now(timezone.utc)).astimezone(timezone.utc).replace(tzinfo=None)
+    default = current_app.config['FEED_REFRESH_INTERVAL']
+    conditions = []
+    for interval in db.session.scalars(sa.select(Feed.refresh_interval).distinct()):
+        same = Feed.refresh_interval.is_(None) if interval is None else Feed.refresh_interval == interval
+        conditions.append(sa.and_(same, Feed.last_refresh <= now - timedelta(seconds=interval or default)))
+    if not conditions:
+        return []
+    return db.session.scalars(
+        sa.select(Feed).where(sa.or_(*conditions)).order_by(Feed.last_refresh)).all()
+
+def record_refresh(feed_id, bulk=False, incremental=True):
+    #refreshes a feed and stores a FeedRun with its outcome and stage timings; None when there
+    #is no such feed, e.g. one deleted after it was found due
+    feed = db.session.get(Feed, feed_id)
+    if feed is None:
+        return None
+    run = FeedRun(feed_id=feed_id, started_at=datetime.now(timezone.utc))
+    start = time.monotonic()
+    with instrument.collect() as timings:
+        try:
+            summary = feed.refresh(bulk=bulk, incremental=incremental)
+            run.status = 'ok'
+            for key in ['inserted', 'updated', 'deleted', 'unchanged']:
+                setattr(run, key, summary[key])
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception(f'Refreshing feed {feed_id} failed')
+            run.status = 'failed'
+            run.error = f'{type(e).__name__}: {e}'
+            #a failing feed waits for its next interval rather than being retried every poll
+            db.session.execute(sa.update(Feed).where(Feed.id == feed_id)
+                               .values(last_refresh=run.started_at))
+    run.duration = time.monotonic() - start
+    run.record_timings(timings)
+    db.session.add(run)
+    db.session.commit()
+    return run.to_dict()
+
+def slowest_feeds(limit=10, since=None):
+    #(feed, runs, average seconds, max seconds, failed runs, HTTP requests, cache entries
+    #reused without a request, 304 responses), slowest average first
+    avg = sa.func.avg(FeedRun.duration)
+    query = (
+        sa.select(Feed, sa.func.count(FeedRun.id), avg, sa.func.max(FeedRun.duration),
+                  sa.func.sum(sa.case((FeedRun.status == 'failed', 1), else_=0)),
+                  sa.func.sum(FeedRun.http_requests), sa.func.sum(FeedRun.http_fresh),
+                  sa.func.sum(FeedRun.http_not_modified))
+        .join(FeedRun.feed).group_by(Feed.id).order_by(avg.desc()).limit(limit))
+    if since is not None:
+        query = query.where(FeedRun.started_at >= since)
+    return db.session.execute(query).all()
+
+def stage_averages(since=None, feed_id=None):
+    #average seconds per run for each stage, slowest first
+    columns = [sa.func.avg(getattr(FeedRun, f'{stage}_seconds')) for stage in instrument.STAGES]
+    query = sa.select(*columns)
+    if since is not None:
+        query = query.where(FeedRun.started_at >= since)
+    if feed_id is not None:
+        query = query.where(FeedRun.feed_id == feed_id)
+    averages = zip(instrument.STAGES, db.session.execute(query).one())
+    return sorted(((stage, seconds or 0.0) for stage, seconds in averages),
+                  key=lambda item: item[1], reverse=True)
+
+class Scheduler:
+    def __init__(self, app, max_workers=4, per_source=1, jitter=0.0, bulk=False,
+                 incremental=True, sleep=time.sleep):
+        self.app = app
+        self.max_workers = max_workers
+        self.jitter = jitter
+        self.bulk = bulk
+        self.incremental = incremental
+        self.sleep = sleep
+        self.source_limits = defaultdict(lambda: threading.BoundedSemaphore(per_source))
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, app):
+        config = app.config
+        return cls(app, config['FEED_REFRESH_WORKERS'], config['FEED_SOURCE_CONCURRENCY'],
+                   config['FEED_REFRESH_JITTER'], config['FEED_REFRESH_BULK'])
+
+    def refresh(self, feed_id, feed_type):
+        #runs in a worker thread with its own app context, and so its own session
+        with self.lock:
+            limit = self.source_limits[feed_type]
+        if self.jitter:
+            self.sleep(random.uniform(0, self.jitter))
+        with limit, self.app.app_context():
+            return record_refresh(feed_id, bulk=self.bulk, incremental=self.incremental)
+
+    def run_once(self, now=None):
+        #refreshes every due feed; returns the recorded runs as dicts
+        feeds = [(feed.id, feed.type) for feed in due_feeds(now)]
+        db.session.commit() #workers use their own sessions; don't hold this one's transaction open
+        if not feeds:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(feeds))) as executor:
+            runs = list(executor.map(lambda feed: self.refresh(*feed), feeds))
+        return [run for run in runs if run is not None]
+
+    def run(self, stop=None, poll=60.0):
+        #polls for due feeds every poll seconds until stop is set; a single pass without stop
+        while True:
+            runs = self.run_once()
+            if runs:
+                failed = sum(run['status'] == 'failed' for run in runs)
+                current_app.logger.info(f'Refreshed {len(runs)} feeds, {failed} failed')
+            if stop is None or stop.wait(poll):
+                return
@@ -0,0 +1,87 @@
+import abc
+import importlib
+import threading
+
+#feed sources by Feed.type. Adapters are registered as 'module:Class' paths and imported the
+#first time a feed of that type is used, so the scraping stack (requests, bs4, ...) is not
+#loaded at app startup. A new source is a FeedAdapter subclass plus a register() call
+
+SOURCES = {
+    'Openlands': 'feeds:Openlands',
+    'ChiHackNight': 'feeds:ChiHackNight',
+}
+
+_loaded = {}
+_lock = threading.Lock()
+
+def register(name, adapter):
+    #adapter is a FeedAdapter subclass or a 'package.module:Class' path
+    with _lock:
+        SOURCES[name] = adapter
+        _loaded.pop(name, None)
+
+def get_source(name):
+    #returns the adapter class registered as name, or None
+    adapter = _loaded.get(name)
+    if adapter is None:
+        path = SOURCES.get(name)
+        if path is None:
+            return None
+        if isinstance(path, str):
+            module_name, _, class_name = path.partition(':')
+            adapter = getattr(importlib.import_module(module_name), class_name)
+        else:
+            adapter = path
+        with _lock:
+            _loaded[name] = adapter
+    return adapter
+
+class FieldMap:
+    #declarative mapping from a source record to event fields. fields maps each event field to
+    #a source key, or to (source key, transform) where transform(value) gives the field value.
+    #The map is compiled once into apply(record); missing source keys map to None
+    def __init__(self, fields):
+        self.fields = dict(fields)
+        self.apply = self.compile()
+
+    def compile(self):
+        plain = []
+        transformed = []
+        for field, source in self.fields.items():
+            if isinstance(source, tuple):
+                transformed.append((field, *source))
+            else:
+                plain.append((field, source))
+        plain = tuple(plain)
+        transformed = tuple(transformed)
+
+        def apply(record):
+            get = record.get
+            event = {field: get(source) for field, source in plain}
+            for field, source, transform in transformed:
+                event[field] = transform(get(source))
+            return event
+        return apply
+
+    def __call__(self, record):
+        return self.apply(record)
+
+class FeedAdapter(abc.ABC):
+    #base class for feed sources. Subclasses set fields to a FieldMap and implement records()
+    #to yield raw source records; expand() can turn one record into several events
+    fields = FieldMap({})
+
+    @abc.abstractmethod
+    def records(self, **kwargs):
+        pass
+
+    def expand(self, record, event):
+        yield event
+
+    def convert(self, record):
+        return self.expand(record, self.fields.apply(record))
+
+    def iter_events(self, **kwargs):
+        #normalized event dicts, produced as the source is read
+        for record in self.records(**kwargs):
+            yield from self.convert(record)
@@ -0,0 +1,232 @@
+import os
+import sys
+import statistics
+import subprocess
+import glob
+import timeit
+import hashlib
+import json
+import random
+from datetime import datetime, timezone, timedelta
+from bs4 import BeautifulSoup
+import sqlalchemy as sa
+from app import create_app, db
+from app.models import Event, User, followers
+from app.pagination import keyset_paginate
+from app.api.events import geohash_ranges
+import app.geohash as geohash
+from config import Config
+import feeds
+
+#micro-benchmarks for hot paths. Run with: python benchmarks.py [name ...]
+
+def legacy_ordered(obj):
+    #the recursive sort create_hash() used before app.fingerprint
+    if isinstance(obj, dict):
+        return sorted((k, legacy_ordered(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return sorted(legacy_ordered(x) for x in obj)
+    else:
+        return obj
+
+def legacy_hash(event):
+    data = event.to_dict()
+    data.pop('id', None)
+    data.pop('timestamp', None)
+    data.pop('hash', None)
+    to_hash = json.dumps(legacy_ordered(data))
+    return hashlib.sha256(to_hash.encode('utf-8')).hexdigest()
+
+def sample_event():
+    now = datetime.now(timezone.utc)
+    return Event(title='Trail stewardship', description='Remove buckthorn ' * 20,
+                 starts_at=now, ends_at=now + timedelta(hours=3),
+                 location='https://maps.google.com/?q=41.886236488388,-87.834408828447',
+                 location_desc='Meet at the north lot', location_lat=41.886236488388,
+                 location_lon=-87.834408828447, original_event_id='2820',
+                 original_event_url='https://www.cervistech.com/acts/webreg/eventdetail.php?event_id=2820',
+                 original_event_category='Restoration', timestamp=now)
+
+def report(name, seconds, number):
+    print(f'{name:<50} {seconds / number * 1e6:10.2f} us/call')
+
+def bench_hashing(number=20000):
+    event = sample_event()
+    fingerprint = Event.content_fingerprint
+    report('legacy ordered()+json.dumps', timeit.timeit(lambda: legacy_hash(event), number=number), number)
+    def uncached():
+        fingerprint.invalidate(event)
+        return fingerprint.of_instance(event)
+    report('fingerprint (uncached)', timeit.timeit(uncached, number=number), number)
+    report('fingerprint (cached)', timeit.timeit(lambda: fingerprint.of_instance(event), number=number), number)
+
+def legacy_find_labels(soup):
+    #the six whole-tree lambda scans getEventDetails used before findLabelCells
+    found = {}
+    for text in ["Opportunity Name:", "Description:"]:
+        found[text] = soup.find(lambda tag: tag.name == "td" and text in tag.text)
+    for text in ["Date/Time:", "Spots Available:", "Meeting Location:", "Organizer:", "Category:"]:
+        found[text] = soup.find(lambda tag: tag.name == "tr" and text in tag.text)
+    return found
+
+def cervis_pages(padding=0):
+    #saved detail pages; padding adds unrelated table rows ahead of the details, as the
+    #real pages' navigation and layout markup does
+    filler = '<table>' + '<tr><td>Lorem ipsum dolor sit amet</td><td>consectetur</td></tr>' * padding + '</table>'
+    pages = []
+    for path in sorted(glob.glob(os.path.join('fixtures', 'cervis', 'eventdetail_*.html'))):
+        with open(path, 'rb') as f:
+            pages.append(f.read().replace(b'<body>', b'<body>' + filler.encode('utf-8'), 1))
+    return pages
+
+def bench_openlands_parse(number=50):
+    default_parser = feeds.HTML_PARSER
+    try:
+        for padding in [0, 200]:
+            pages = cervis_pages(padding)
+            per_page = number * len(pages)
+            soups = [BeautifulSoup(page, "html.parser") for page in pages]
+            report(f'label lookup, 6 scans, {padding} filler rows',
+                   timeit.timeit(lambda: [legacy_find_labels(soup) for soup in soups], number=number), per_page)
+            report(f'label lookup, findLabelCells, {padding} filler rows',
+                   timeit.timeit(lambda: [feeds.Openlands.findLabelCells(soup) for soup in soups], number=number), per_page)
+            for parser in sorted({'html.parser', default_parser}):
+                feeds.HTML_PARSER = parser
+                report(f'parseEventDetails, {parser}, {padding} filler rows',
+                       timeit.timeit(lambda: [feeds.Openlands.parseEventDetails('2820', page) for page in pages],
+                                     number=number), per_page)
+    finally:
+        feeds.HTML_PARSER = default_parser
+
+#modules create_app() must not import; they load on first use
+DEFERRED_MODULES = ['feeds', 'requests', 'bs4', 'pandas', 'geopy', 'playwright', 'extruct',
+                    'app.crawler.org_crawler']
+
+STARTUP_PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+from app import create_app
+from config import Config
+class ProbeConfig(Config):
+    TESTING = True
+create_app(ProbeConfig)
+print(json.dumps({'seconds': time.perf_counter() - start,
+                  'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'loaded': [m for m in %r if m in sys.modules]}))
+''' % DEFERRED_MODULES
+
+def probe_startup(preload=()):
+    #create_app() in a fresh interpreter; preload imports modules first, as startup used to
+    output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, *preload], check=True,
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.splitlines()[-1])
+
+def bench_startup(number=5):
+    eager = ['feeds', 'app.crawler.org_crawler', 'geopy.geocoders']
+    for name, preload in [('create_app()', ()), ('create_app() with eager imports', eager)]:
+        runs = [probe_startup(preload) for _ in range(number)]
+        seconds = statistics.median(run['seconds'] for run in runs)
+        rss = statistics.median(run['rss_kb'] for run in runs)
+        print(f'{name:<50} {seconds * 1e3:10.1f} ms {rss / 1024:8.1f} MB max RSS')
+
+class BenchConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+def bench_app():
+    #an app with an empty in-memory database, pushed as the current app context
+    app = create_app(BenchConfig)
+    app.app_context().push()
+    db.create_all()
+    return app
+
+def bench_spatial(events=200000, number=50):
+    #nearby queries over events spread across the continental US: a full scan with a
+    #haversine check, the (location_lat, location_lon) index and the geohash cover
+    bench_app()
+    rng = random.Random(0)
+    rows = []
+    for i in range(events):
+        lat, lon = rng.uniform(25, 49), rng.uniform(-124, -67)
+        rows.append({'title': f'event {i}', 'starts_at': datetime(2025, 1, 1), 'timestamp': datetime(2025, 1, 1),
+                     'user_id': 1, 'location_lat': lat, 'location_lon': lon,
+                     'geohash': geohash.encode(lat, lon)})
+    db.session.execute(sa.insert(Event), rows)
+    db.session.commit()
+    lat, lon, km = 41.8781, -87.6298, 25
+    (min_lat, min_lon, max_lat, max_lon), = geohash.boxes_around(lat, lon, km)
+    columns = sa.select(Event.id, Event.location_lat, Event.location_lon)
+    queries = {
+        'full scan': columns.where(Event.location_lat.is_not(None)),
+        'lat/lon index': columns.where(Event.location_lat.between(min_lat, max_lat),
+                                       Event.location_lon.between(min_lon, max_lon)),
+        'geohash cover': columns.where(geohash_ranges([(min_lat, min_lon, max_lat, max_lon)])),
+    }
+    def nearby(query):
+        return sorted(id for id, event_lat, event_lon in db.session.execute(query)
+                      if geohash.haversine_km(lat, lon, event_lat, event_lon) <= km)
+    expected = nearby(queries['full scan'])
+    for name, query in queries.items():
+        assert nearby(query) == expected, name
+        runs = number if query is not queries['full scan'] else max(1, number // 25)
+        report(f'nearby {km}km of {events} events, {name}',
+               timeit.timeit(lambda: nearby(query), number=runs), runs)
+
+def legacy_following_events(user):
+    Source = sa.orm.aliased(User)
+    Follower = sa.orm.aliased(User)
+    return (
+        sa.select(Event)
+        .join(Event.owner.of_type(Source))
+        .join(Source.followers.of_type(Follower), isouter=True)
+        .where(sa.or_(Follower.id == user.id, Source.id == user.id))
+        .group_by(Event)
+        .order_by(Event.starts_at.asc(), Event.id.asc())
+    )
+
+def bench_timeline(users=2000, follows=50, events=100, number=20):
+    #first /feed page (keyset, 10 events) for a user in a synthetic social graph: users follow
+    #a skewed sample of owners, a few owners have many followers
+    bench_app()
+    rng = random.Random(0)
+    db.session.execute(sa.insert(User), [
+        {'username': f'user{i}', 'email': f'user{i}@example.com', 'account_type': 'user'}
+        for i in range(users)])
+    ids = list(range(1, users + 1))
+    weights = [1 / i for i in ids]
+    db.session.execute(sa.insert(followers), [
+        {'follower_id': follower, 'followed_id': followed} for follower in ids
+        for followed in set(rng.choices(ids, weights, k=follows)) - {follower}])
+    start = datetime(2025, 1, 1)
+    db.session.execute(sa.insert(Event), [
+        {'title': f'event {i}', 'user_id': rng.choice(ids), 'timestamp': start,
+         'starts_at': start + timedelta(minutes=rng.randrange(525600))} for i in range(users * events // 10)])
+    db.session.commit()
+    user = db.session.get(User, users // 2)
+    expected = db.session.scalars(legacy_following_events(user).limit(20)).all()
+    for name, query in [('join/OR/GROUP BY', legacy_following_events(user)),
+                        ('IN over UNION', user.following_events())]:
+        page = keyset_paginate(query, (Event.starts_at, Event.id), 10)
+        next_page = keyset_paginate(query, (Event.starts_at, Event.id), 10, page.next_cursor)
+        assert page.items + next_page.items == expected, name
+        report(f'timeline first page, {name}',
+               timeit.timeit(lambda: keyset_paginate(query, (Event.starts_at, Event.id), 10), number=number), number)
+        report(f'timeline next page, {name}',
+               timeit.timeit(lambda: keyset_paginate(query, (Event.starts_at, Event.id), 10, page.next_cursor),
+                             number=number), number)
+
+BENCHMARKS = {
+    'hashing': bench_hashing,
+    'openlands_parse': bench_openlands_parse,
+    'startup': bench_startup,
+    'spatial': bench_spatial,
+    'timeline': bench_timeline,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f'--- {name} ---')
+        BENCHMARKS[name]()
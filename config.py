@@ -14,4 +14,42 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['test@example.com']
     POSTS_PER_PAGE = 10
-    DEFAULT_TIMEZONE = "America/Chicago"
\ No newline at end of file
+    DEFAULT_TIMEZONE = "America/Chicago"
+    #background refreshes (flask feeds run): default interval between refreshes of a feed in
+    #seconds, worker threads, concurrent refreshes per feed type, and max random start delay
+    FEED_REFRESH_INTERVAL = int(os.environ.get('FEED_REFRESH_INTERVAL') or 6 * 3600)
+    FEED_REFRESH_WORKERS = int(os.environ.get('FEED_REFRESH_WORKERS') or 4)
+    FEED_SOURCE_CONCURRENCY = int(os.environ.get('FEED_SOURCE_CONCURRENCY') or 1)
+    FEED_REFRESH_JITTER = float(os.environ.get('FEED_REFRESH_JITTER') or 30.0)
+    FEED_REFRESH_BULK = os.environ.get('FEED_REFRESH_BULK') is not None
+    FEED_BATCH_SIZE = int(os.environ.get('FEED_BATCH_SIZE') or 100)
+    FEED_BULK_CHUNK_SIZE = int(os.environ.get('FEED_BULK_CHUNK_SIZE') or 500)
+    #incremental refreshes re-fetch stored events at most this many seconds after their last
+    #check, and no more than FEED_REVALIDATE_BATCH listing ids per refresh
+    FEED_REVALIDATE_AFTER = int(os.environ.get('FEED_REVALIDATE_AFTER') or 24 * 3600)
+    FEED_REVALIDATE_BATCH = int(os.environ.get('FEED_REVALIDATE_BATCH') or 20)
+    #seconds an authenticated user is served from the in-process auth cache; 0 disables it
+    AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL') or 60)
+    AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE') or 1024)
+    #last_seen changes smaller than LAST_SEEN_INTERVAL seconds are ignored; the rest are
+    #buffered and written together every LAST_SEEN_FLUSH_INTERVAL seconds (0 writes at once)
+    LAST_SEEN_INTERVAL = int(os.environ.get('LAST_SEEN_INTERVAL') or 300)
+    LAST_SEEN_FLUSH_INTERVAL = float(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 5.0)
+    #.ics exports hold events from this many days back onwards; clients may reuse an export
+    #for ICS_MAX_AGE seconds before revalidating it with its ETag
+    ICS_PAST_DAYS = int(os.environ.get('ICS_PAST_DAYS') or 30)
+    ICS_MAX_AGE = int(os.environ.get('ICS_MAX_AGE') or 300)
+    ICS_YIELD_PER = int(os.environ.get('ICS_YIELD_PER') or 500)
+    #SQLite file keeping feed responses' validators and parses across processes, so a one-off
+    #`flask feeds run` or a restarted worker revalidates instead of refetching; None keeps
+    #the cache in memory only. Relative paths are taken from the app's instance folder
+    FEED_HTTP_CACHE_PATH = os.environ.get('FEED_HTTP_CACHE_PATH') or 'feed_http_cache.db'
+    #relative paths are taken from the app's instance folder, like Flask-SQLAlchemy's
+    GEOCODE_CACHE_PATH = os.environ.get('GEOCODE_CACHE_PATH') or 'geocode.db'
+    GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL') or 30 * 24 * 3600)
+    GEOCODE_NEGATIVE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_TTL') or 24 * 3600)
+    GEOCODE_CACHE_SIZE = int(os.environ.get('GEOCODE_CACHE_SIZE') or 1024)
+    GEOCODE_ASYNC = os.environ.get('GEOCODE_ASYNC') is not None
+    GEOCODER_BACKEND = os.environ.get('GEOCODER_BACKEND') or 'nominatim'
+    GEOCODE_RATE = float(os.environ.get('GEOCODE_RATE') or 1.0) #requests per second
+    GEOCODE_BATCH_SIZE = int(os.environ.get('GEOCODE_BATCH_SIZE') or 50)
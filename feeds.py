@@ -1,21 +1,193 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, parse_qs
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, OrderedDict, deque
+from dataclasses import dataclass
 from app.time import local_to_utc
+from app.sources import FeedAdapter, FieldMap
+from app import httpcache
+import app.instrument as instrument
 import re
+import html
+import copy
 import hashlib
-
-#chihacknight
-import pandas as pd
-import json
+import threading
+import time
 
 #from feedgen.feed import FeedGenerator
 
+#lxml is much faster than the pure-Python parser; fall back when it is not installed
+try:
+    import lxml
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+TAG_PATTERN = re.compile(r'<[^>]*>')
+
 headers = {
     "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/117.0"
 }
 
+@dataclass
+class CacheEntry:
+    etag: str
+    last_modified: str
+    body_hash: str
+    parsed: object
+    checked: float #clock() when the server last confirmed or sent this entry
+
+class HttpClient:
+    #shared keep-alive session for a feed source: bounded worker pool, per-host concurrency
+    #limit, request timeout and retry with exponential backoff on connection errors and 429/5xx.
+    #fetch() adds a conditional-request cache: parse results are stored with the response's
+    #validators and body hash, and a 304 or byte-identical body reuses the earlier parse. An
+    #entry checked less than max_age seconds ago is reused without a request. The cache is an
+    #LRU in memory, in front of an optional app.httpcache.HttpCacheStore that keeps entries
+    #across processes; clock is wall time so stored entries stay comparable after a restart
+    def __init__(self, max_workers=8, per_host=4, timeout=15, retries=3, backoff=0.5,
+                 cache_size=512, clock=time.time, store=None):
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.clock = clock
+        self.store = store
+        self.stats = {'requests': 0, 'bytes': 0, 'fresh': 0, 'not_modified': 0, 'unchanged': 0,
+                      'parsed': 0}
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+        #pool_maxsize is the connections kept per host, which per_host requests can use at once
+        adapter = HTTPAdapter(pool_maxsize=per_host, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.host_limits = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None):
+        host = urlparse(url).netloc
+        with self.lock:
+            limit = self.host_limits[host]
+        with limit, instrument.stage('fetch'):
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        self.count('requests')
+        self.count('bytes', len(response.content))
+        return response
+
+    def count(self, stat, n=1):
+        #also counted as http_<stat> for the refresh being timed (see FeedRun.record_timings)
+        with self.lock:
+            self.stats[stat] += n
+        instrument.count(f'http_{stat}', n)
+
+    def cached(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+        if entry is None and self.store is not None:
+            stored = self.store.get(key)
+            if stored is not None:
+                entry = CacheEntry(*stored)
+                self.remember(key, entry)
+        return entry
+
+    def remember(self, key, entry):
+        with self.lock:
+            self.cache[key] = entry
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def fetch(self, url, parse, key=None, max_age=None):
+        #returns parse(content) for url; key separates parses of the same url
+        return self.revalidate(url, parse, key, max_age)[0]
+
+    def revalidate(self, url, parse, key=None, max_age=None):
+        #fetch(), also returning whether the content changed since the cached parse
+        key = key or url
+        entry = self.cached(key)
+        now = self.clock()
+        if entry and max_age is not None and now - entry.checked < max_age:
+            self.count('fresh')
+            return copy.deepcopy(entry.parsed), False
+        conditional = {}
+        if entry and entry.etag:
+            conditional['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            conditional['If-Modified-Since'] = entry.last_modified
+        response = self.get(url, headers=conditional)
+        if entry and response.status_code == 304:
+            self.count('not_modified')
+            entry.checked = now
+            if self.store is not None:
+                self.store.touch(key, now)
+            return copy.deepcopy(entry.parsed), False
+        body_hash = hashlib.sha256(response.content).hexdigest()
+        changed = not (entry and entry.body_hash == body_hash)
+        if changed:
+            self.count('parsed')
+            with instrument.stage('parse'):
+                parsed = parse(response.content)
+        else:
+            self.count('unchanged')
+            parsed = entry.parsed
+        if response.status_code == 200:
+            entry = CacheEntry(response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                               body_hash, parsed, now)
+            self.remember(key, entry)
+            if self.store is not None:
+                self.store.set(key, entry.etag, entry.last_modified, entry.body_hash, entry.parsed,
+                               entry.checked)
+        #callers are free to mutate what they get back
+        return copy.deepcopy(parsed), changed
+
+    def map(self, fn, items):
+        #results come back in the order of items regardless of completion order
+        items = list(items)
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            return list(executor.map(instrument.propagate(fn), items))
+
+    def imap(self, fn, items):
+        #lazy map(): at most max_workers calls run ahead of the consumer, so results are not
+        #buffered faster than they are used. Order is kept
+        fn = instrument.propagate(fn)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for item in items:
+                pending.append(executor.submit(fn, item))
+                if len(pending) >= self.max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+class lazy_client:
+    #class attribute holding a source's HttpClient, created on first use so that importing
+    #feeds opens no session. Its cache persists through the app's httpcache store
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.client = None
+        self.lock = threading.Lock()
+
+    def __get__(self, instance, owner):
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    self.client = HttpClient(store=httpcache, **self.kwargs)
+        return self.client
+
+def cache_stats():
+    #HTTP cache counters per feed source
+    return {name: dict(feed_class.http.stats) for name, feed_class in
+            [('Openlands', Openlands), ('ChiHackNight', ChiHackNight)]}
+
 def string_to_dict(data, row_sep='\n', col_sep='=', key_type=str, value_type=str):
     return {
         key_type(pair.split(col_sep)[0].strip()): value_type(pair.split(col_sep)[1].strip())
@@ -44,77 +216,101 @@ def camel_to_snake(name):
     # Convert the entire string to lowercase
     return s1.lower()
 
-class Openlands:
+class Openlands(FeedAdapter):
     #TODO - check if there exists an img tag with src similar to the below (just org_id and event_id should be sufficient). This is the event image (doesn't always exist)
     #https://cdn.cervistech.com/acts/module/display_event_photo.php?event_id=2820&org_id=0254&ver=b6f6f4cca95e93394bacf9f2f229cd39d24b9efe0689988b156be38ed5a9ccc9
 
-    url = 'https://www.cervistech.com/acts/webreg/eventwebreglist.php?org_id=0254'
+    base_url = 'https://www.cervistech.com/acts/webreg/'
+    org_id = '0254'
+    http = lazy_client()
+
+    @staticmethod
+    def list_url():
+        return f'{Openlands.base_url}eventwebreglist.php?org_id={Openlands.org_id}'
+
+    @staticmethod
+    def detail_url(eventId):
+        return f'{Openlands.base_url}eventdetail.php?event_id={eventId}&org_id={Openlands.org_id}'
+
+    #detail pages checked this recently are not requested again by a full refresh; older ones
+    #are revalidated one by one with their own conditional requests
+    detail_max_age = 3600
 
     @staticmethod
-    def getEventDetails(eventId):
+    def getEventDetails(eventId, max_age=None):
         # print("eventId: ", eventId)
+        return Openlands.http.fetch(f'{Openlands.detail_url(eventId)}&hide_buttons=yes&back=min',
+                                    lambda content: Openlands.parseEventDetails(eventId, content),
+                                    max_age=max_age)
+
+    LABELS = ("Opportunity Name:", "Description:", "Date/Time:", "Spots Available:",
+              "Meeting Location:", "Organizer:", "Category:")
+    LABEL_PATTERN = re.compile("|".join(re.escape(label) for label in LABELS))
+
+    @staticmethod
+    def findLabelCells(soup):
+        #one pass over the page's text nodes maps each label to its enclosing td and tr;
+        #the first occurrence of a label wins
+        cells = {}
+        for string in soup.find_all(string=Openlands.LABEL_PATTERN):
+            for label in Openlands.LABEL_PATTERN.findall(string):
+                if label not in cells:
+                    cells[label] = {'td': string.find_parent('td'), 'tr': string.find_parent('tr')}
+            if len(cells) == len(Openlands.LABELS):
+                break
+        return cells
+
+    @staticmethod
+    def labelText(cells, label, scope):
+        return cells[label][scope].get_text().replace(label, "").strip()
+
+    @staticmethod
+    def parseEventDetails(eventId, content):
         details = {'event_id': eventId}
-        event = requests.get(f'https://www.cervistech.com/acts/webreg/eventdetail.php?event_id={eventId}&org_id=0254&hide_buttons=yes&back=min',headers=headers)
-        soup = BeautifulSoup(event.content, "html.parser")
+        soup = BeautifulSoup(content, HTML_PARSER)
+        cells = Openlands.findLabelCells(soup)
         slots = []
 
         try:
-            text = "Opportunity Name:"
-            element = soup.find(lambda tag: tag.name == "td" and text in tag.text)
-            details['opportunity_name'] = element.get_text().replace(text,"").strip()
-        except:
-            element
+            details['opportunity_name'] = Openlands.labelText(cells, "Opportunity Name:", 'td')
+        except Exception:
+            pass
 
         try:
-            text = "Description:"
-            element = soup.find(lambda tag: tag.name == "td" and text in tag.text)
-            details['description'] = element.get_text().replace(text,"").strip()
-        except:
-            element
+            details['description'] = Openlands.labelText(cells, "Description:", 'td')
+        except Exception:
+            pass
 
         try:
-            text = "Date/Time:"
-            element = soup.find(lambda tag: tag.name == "tr" and text in tag.text)
-            tempVal = element.get_text().replace(text,"").strip()         #	Tue, May 20, 2025 - 7:30 PM to 8:30 PM
+            tempVal = Openlands.labelText(cells, "Date/Time:", 'tr') #	Tue, May 20, 2025 - 7:30 PM to 8:30 PM
             slot = Openlands.parseEventTime(tempVal)
-
-            text = "Spots Available:"
-            element = soup.find(lambda tag: tag.name == "tr" and text in tag.text)
-            tempVal = element.get_text().replace(text,"").strip()
+            tempVal = Openlands.labelText(cells, "Spots Available:", 'tr')
             slot['spots_available'] = Openlands.parseSlotsAvailable(tempVal)
-
             slots.append(slot)
-        except:
-            element
+        except Exception:
+            pass
 
         try:
-            text = "Meeting Location:"
-            element = soup.find(lambda tag: tag.name == "tr" and text in tag.text)
-            details['meeting_location_desc'] = element.get_text().replace(text,"").replace("View Map / Get Directions","").strip()
-            details['meeting_location'] = element.find("a")["href"]
-        except:
-            element
+            details['meeting_location_desc'] = Openlands.labelText(cells, "Meeting Location:", 'tr').replace("View Map / Get Directions","").strip()
+            details['meeting_location'] = cells["Meeting Location:"]['tr'].find("a")["href"]
+        except Exception:
+            pass
 
         try:
-            text = "Organizer:"
-            element = soup.find(lambda tag: tag.name == "tr" and text in tag.text)
-            details['organizer'] = Openlands.parseOrganizer(element) # element.get_text().replace(text,"") #.strip()
-        except:
-            element
+            details['organizer'] = Openlands.parseOrganizer(cells["Organizer:"]['tr'])
+        except Exception:
+            pass
 
         try:
-            text = "Category:"
-            element = soup.find(lambda tag: tag.name == "tr" and text in tag.text)
-            #print(element.get_text())
-            details['category'] = element.get_text().replace(text,"").strip()
-        except:
-            element
+            details['category'] = Openlands.labelText(cells, "Category:", 'tr')
+        except Exception:
+            pass
 
         #timeslots (doesn't always exist) 2596, 2591, 2503 
         slots = [*slots, *Openlands.extractSlotsTable(soup.find('table', id='result_list'))]
         details['slots'] = slots
 
-        details['url'] =  f"https://www.cervistech.com/acts/webreg/eventdetail.php?event_id={eventId}&org_id=0254" #&hide_buttons=yes&back=min"
+        details['url'] = Openlands.detail_url(eventId) #&hide_buttons=yes&back=min
 
         event_time = Openlands.establishEventTime(slots)
         if not event_time is None:
@@ -160,7 +356,8 @@ class Openlands:
     @staticmethod
     def parseSlotsAvailable(text):
         retval = ''
-        parse = BeautifulSoup(text,"html.parser").get_text()
+        #text is a short cell or attribute value; stripping tags and entities does not need a full parse
+        parse = html.unescape(TAG_PATTERN.sub('', text))
         if parse == 'Unlimited':
             retval = 99
         elif parse == 'Waitlist':
@@ -217,72 +414,116 @@ class Openlands:
         return slots
     
     @staticmethod
-    def get(destination="feed"):
-        response = requests.get(Openlands.url, headers=headers)
-        soup = BeautifulSoup(response.content, "html.parser")
+    def parseListingIds(content):
+        soup = BeautifulSoup(content, HTML_PARSER)
 
         # Check the status code
         #print(f"Status Code: {response.status_code}")
 
         links = soup.find_all('a')
-        raw_events = []
+        ids = []
 
         for link in links:
             if 'event_id' in link['href']:
                 parsed = urlparse(link['href'])
-                id = parse_qs(parsed.query)['event_id'][0]
-                raw_event = Openlands.getEventDetails(id)
+                ids.append(parse_qs(parsed.query)['event_id'][0])
+        return ids
 
-                #if event has an event time
-                if not raw_event is None:
-                    raw_events.append(raw_event)
+    @staticmethod
+    def listing():
+        #(event ids on the listing page, whether the listing changed since it was last fetched)
+        return Openlands.http.revalidate(Openlands.list_url(), Openlands.parseListingIds,
+                                         key=f'{Openlands.list_url()}#ids')
+
+    @staticmethod
+    def list_event_ids():
+        #event ids on the listing page, for incremental refreshes
+        return Openlands.listing()[0]
+
+    @staticmethod
+    def base_event_id(original_event_id):
+        #events with several time slots are stored as '<event_id>-<slot number>'
+        return original_event_id.split('-')[0]
+
+    fields = FieldMap({
+        "title": "opportunity_name",
+        "description": "description",
+        "starts_at": "start_time",
+        "ends_at": "end_time",
+        "location": "meeting_location",
+        "location_desc": "meeting_location_desc",
+        "original_event_id": "event_id",
+        "original_event_url": "url",
+        "original_event_category": "category",
+    })
+
+    def records(self, event_ids=None):
+        #detail pages are fetched a few at a time as events are consumed, so a refresh can
+        #write early events while later pages are still loading. When the listing is unchanged
+        #(a 304 or an identical body), detail pages checked within detail_max_age are reused
+        #without a request; otherwise each is revalidated
+        max_age = None
+        if event_ids is None:
+            event_ids, changed = Openlands.listing()
+            if not changed:
+                max_age = Openlands.detail_max_age
+        details = Openlands.http.imap(lambda id: Openlands.getEventDetails(id, max_age), event_ids)
+        for raw_event in details:
+            if not raw_event is None: #if event has an event time
+                yield raw_event
+
+    def expand(self, raw_event, event):
+        #one event per time slot; events with several slots are numbered '<event_id>-<slot number>'
+        slots = raw_event['slots']
+        if len(slots) > 1:
+            for i, slot in enumerate(slots, 1):
+                yield {**event, 'starts_at': slot['start_time'], 'ends_at': slot['end_time'],
+                       'original_event_id': f"{event['original_event_id']}-{i}"}
+        else:
+            yield event
+
+    @staticmethod
+    def get(destination="feed", event_ids=None):
+        #event_ids limits an incremental refresh to these detail pages
+        raw_events = list(Openlands().records(event_ids))
 
         #reusable methods (but not in reusable class yet)
         data_keys_to_snake_case(raw_events)
 
         #send whole bridge or convert to feed for ingestion into event model
         if destination == "feed":
-            field_map = {
-                "opportunity_name": "title",
-                "start_time": "starts_at",
-                "end_time": "ends_at",
-                "meeting_location": "location",
-                "meeting_location_desc": "location_desc",
-                "event_id": "original_event_id",
-                "url": "original_event_url",
-                "category": "original_event_category",
-            }
-            events = []
-            for raw_event in raw_events:
-                raw_event.pop('organizer')
-                if len(raw_event['slots']) > 1:
-                    i=0
-                    for slot in raw_event['slots']:
-                        i=i+1
-                        #slot has start_time and end_time. raw_event has everything else, just needs start_time and end_time replaced
-                        slot_event = raw_event.copy()
-                        slot_event.pop('slots')
-                        slot_event['start_time'] = slot['start_time']
-                        slot_event['end_time'] = slot['end_time']
-                        slot_event['event_id'] = f"{slot_event['event_id']}-{i}"
-                        event = {field_map.get(k, k): v for k, v in slot_event.items()}
-                        events.append(event)
-                else:
-                    raw_event.pop('slots')
-                    event = {field_map.get(k, k): v for k, v in raw_event.items()}
-                    events.append(event)
-            return events
+            adapter = Openlands()
+            return [event for raw_event in raw_events for event in adapter.convert(raw_event)]
         elif destination == "bridge":
             return raw_events
 
 
-class ChiHackNight():
+class ChiHackNight(FeedAdapter):
     url = "https://chihacknight.org/events/index.html"
+    http = lazy_client()
 
     @staticmethod
     def get(status='upcoming'):
-        response = requests.get(ChiHackNight.url, headers=headers)
-        soup = BeautifulSoup(response.content, 'html.parser')
+        return ChiHackNight.http.fetch(ChiHackNight.url,
+                                       lambda content: ChiHackNight.parse(content, status),
+                                       key=f'{ChiHackNight.url}#{status}')
+
+    fields = FieldMap({
+        "title": "title",
+        "description": ("speakers", lambda speakers: speakers or None),
+        "starts_at": "starts_at",
+        "original_event_id": "id",
+        "original_event_url": "url",
+        "original_event_category": ("tags", lambda tags: ', '.join(tags) or None),
+    })
+
+    def records(self, status='upcoming'):
+        #events without a start time are skipped
+        return (raw_event for raw_event in ChiHackNight.get(status) if raw_event['starts_at'])
+
+    @staticmethod
+    def parse(content, status):
+        soup = BeautifulSoup(content, HTML_PARSER)
         upcoming_events = []
         past_events = []
         if status == 'upcoming' or status == 'all':
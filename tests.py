@@ -1,13 +1,133 @@
 from datetime import datetime, timezone, timedelta
+import os
+import re
+import json
+import hashlib
+import tempfile
+import threading
 import unittest
-from app import create_app, db
-from app.models import User, Event, Collection, Feed
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import sqlalchemy as sa
+from unittest import mock
+from app import create_app, db, authcache, lastseen
+from app.lastseen import LastSeenBuffer
+import app.ics.icalendar as icalendar
+from app.models import User, Event, Collection, Feed, FeedRun
+from app.reconcile import diff_events
+from app.geocache import GeocodeCache
+from app.httpcache import HttpCacheStore
+from app.geocoding import CensusBackend, GeocodeQueue, RateLimiter
+from app.coordinates import parse_coordinates
+from app.scheduler import Scheduler, due_feeds, record_refresh, slowest_feeds, stage_averages
+import app.instrument as instrument
+from app.pagination import keyset_paginate, InvalidCursor, decode_cursor
+import app.geohash as geohash
+import app.sources as sources
+import app.location as location
 from config import Config
+import feeds
+from benchmarks import probe_startup
 
 class TestConfig(Config):
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    #set TEST_DATABASE_URL to run against Postgres; query plans are checked with its EXPLAIN
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or 'sqlite://'
     ELASTICSEARCH_URL = None
+    GEOCODE_CACHE_PATH = None
+    FEED_HTTP_CACHE_PATH = None
+    LAST_SEEN_FLUSH_INTERVAL = 0 #written by the request, no flusher thread
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+class CervisFixtureHandler(BaseHTTPRequestHandler):
+    #serves saved Cervis pages from fixtures/cervis
+    delays = {}
+    requests = []
+    etags = True
+    edits = {} #page name -> (old, new) bytes replaced in the saved page
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.requests.append(self.path)
+        name = os.path.basename(url.path).replace('.php', '')
+        if name == 'eventdetail':
+            event_id = parse_qs(url.query)['event_id'][0]
+            time.sleep(self.delays.get(event_id, 0))
+            name = f'eventdetail_{event_id}'
+        path = os.path.join(FIXTURES, 'cervis', f'{name}.html')
+        if not os.path.exists(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        if name in self.edits:
+            body = body.replace(*self.edits[name])
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.etags and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.etags:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@contextmanager
+def serve_cervis_fixtures(delays=None, etags=True):
+    handler = type('Handler', (CervisFixtureHandler,),
+                   {'delays': delays or {}, 'requests': [], 'etags': etags, 'edits': {}})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with mock.patch.object(feeds.Openlands, 'base_url',
+                               f'http://127.0.0.1:{server.server_port}/acts/webreg/'):
+            yield handler
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@contextmanager
+def capture_selects(engine=None):
+    #SELECT statements run while the block executes, as (sql, parameters) for query_plan()
+    engine = engine or db.engine
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            statements.append((statement, parameters))
+    sa.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+def query_plan(statement, parameters):
+    #plan lines: EXPLAIN QUERY PLAN details on SQLite, EXPLAIN output on Postgres. Postgres is
+    #told to avoid sequential scans, so one in the plan means no usable index
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        return [row[0] for row in connection.exec_driver_sql('EXPLAIN ' + statement, parameters)]
+    return [row[3] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+
+def full_scans(plan):
+    #plan lines that read a whole table rather than an index range or an index in order
+    return [line for line in plan
+            if re.match(r'\s*(->\s*)?(Parallel )?Seq Scan on ', line)
+            or re.fullmatch(r'SCAN (TABLE )?\w+', line)]
+
+def sorts(plan):
+    #plan lines sorting rows the index did not return in order
+    return [line for line in plan if 'TEMP B-TREE FOR ORDER BY' in line
+            or re.match(r'\s*(->\s*)?(Incremental )?Sort ', line)]
 
 class UserModelCase(unittest.TestCase):
 
@@ -175,7 +295,828 @@ class UserModelCase(unittest.TestCase):
 
         f1.refresh()
 
-    
+
+    def create_feed(self):
+        o1 = User(username='Openlands', account_type='Organization')
+        f1 = Feed(name='Cervis', type='Openlands', owner=o1)
+        db.session.add_all([o1, f1])
+        db.session.commit()
+        return f1
+
+    def feed_record(self, original_event_id, title):
+        return {
+            'original_event_id': original_event_id,
+            'title': title,
+            'description': f'{title} description',
+            'starts_at': '2025-05-21T00:30:00+00:00',
+            'ends_at': '2025-05-21T01:30:00+00:00',
+            'location': 'https://maps.google.com/?q=41.886236488388,-87.834408828447',
+        }
+
+    def test_08_diff_events(self):
+        stored = [Event(original_event_id='1', title='a'), Event(original_event_id='2', title='b duplicate'),
+                  Event(original_event_id='2', title='b')]
+        incoming = [self.feed_record('2', 'b'), self.feed_record('3', 'c')]
+        with mock.patch.object(Event, 'check_hash', lambda self, data: self.title == data['title']):
+            diff = diff_events(stored, incoming)
+        self.assertEqual([r['original_event_id'] for r in diff.inserts], ['3'])
+        self.assertEqual(diff.updates, [])
+        self.assertEqual(diff.unchanged, [stored[2]])
+        self.assertEqual(sorted(e.title for e in diff.deletes), ['a', 'b duplicate'])
+        self.assertEqual(diff.summary(), {'inserted': 1, 'updated': 0, 'deleted': 2, 'unchanged': 1})
+
+    def test_09_feed_refresh_reconciles(self):
+        f1 = self.create_feed()
+        with mock.patch.object(feeds.Openlands, 'iter_events', return_value=[
+                self.feed_record('1', 'a'), self.feed_record('2', 'b')]):
+            self.assertEqual(f1.refresh()['inserted'], 2)
+        with mock.patch.object(feeds.Openlands, 'iter_events', return_value=[
+                self.feed_record('2', 'b changed'), self.feed_record('3', 'c')]):
+            summary = f1.refresh()
+        self.assertEqual(summary, {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 0})
+        events = db.session.scalars(f1.events.select().order_by(Event.original_event_id)).all()
+        self.assertEqual([(e.original_event_id, e.title) for e in events], [('2', 'b changed'), ('3', 'c')])
+
+    def test_10_feed_refresh_bulk(self):
+        f1 = self.create_feed()
+        self.app.config['FEED_BULK_CHUNK_SIZE'] = 2
+        records = [self.feed_record(str(i), f'event {i}') for i in range(5)]
+        with mock.patch.object(feeds.Openlands, 'iter_events', return_value=records):
+            self.assertEqual(f1.refresh(bulk=True)['inserted'], 5)
+        records = [self.feed_record(str(i), f'event {i}') for i in range(1, 5)]
+        records[0]['title'] = 'event 1 changed'
+        records.append(self.feed_record('5', 'event 5'))
+        with mock.patch.object(feeds.Openlands, 'iter_events', return_value=records):
+            summary = f1.refresh(bulk=True)
+        self.assertEqual(summary, {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 3})
+        events = db.session.scalars(f1.events.select().order_by(Event.original_event_id)).all()
+        self.assertEqual([e.title for e in events],
+                         ['event 1 changed', 'event 2', 'event 3', 'event 4', 'event 5'])
+        self.assertTrue(all(e.owner == f1.owner for e in events))
+
+    def test_11_feed_refresh_unchanged_is_noop(self):
+        f1 = self.create_feed()
+        records = [self.feed_record('1', 'a'), self.feed_record('2', 'b')]
+        with mock.patch.object(feeds.Openlands, 'iter_events', return_value=[dict(r) for r in records]):
+            f1.refresh()
+        statements = []
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement.split()[0])
+        sa.event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            with mock.patch.object(feeds.Openlands, 'iter_events', return_value=[dict(records[0])]):
+                summary = f1.refresh()
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute', capture)
+        self.assertEqual(summary, {'inserted': 0, 'updated': 0, 'deleted': 1, 'unchanged': 1})
+        #only the feed's last_refresh is updated; the vanished event is one set-based DELETE
+        self.assertEqual(statements.count('INSERT'), 0)
+        self.assertEqual(statements.count('UPDATE'), 1)
+        self.assertEqual(statements.count('DELETE'), 2) #collection membership, then events
+        event = db.session.scalar(f1.events.select())
+        self.assertEqual(event.location_lat, 41.886236488388)
+        self.assertTrue(event.check_hash(dict(records[0])))
+
+    def test_12_event_fingerprint_cache(self):
+        record = self.feed_record('1', 'a')
+        e1 = Event(owner=self.users[0])
+        e1.from_dict(dict(record))
+        db.session.add(e1)
+        db.session.commit()
+        digest = e1.hash
+        self.assertTrue(e1.check_hash(record))
+        self.assertEqual(Event.content_fingerprint.of_instance(e1), digest)
+        e1.location_lat = 0.0 #not a hashed field
+        db.session.commit()
+        self.assertEqual(e1.hash, digest)
+        e1.title = 'b'
+        db.session.commit()
+        self.assertNotEqual(e1.hash, digest)
+        self.assertTrue(e1.check_hash({**record, 'title': 'b'}))
+        #equivalent datetimes in another offset hash the same
+        self.assertTrue(e1.check_hash({**record, 'title': 'b',
+                                       'starts_at': '2025-05-20T19:30:00-05:00'}))
+
+    def test_13_flush_hashes_only_changed_fields(self):
+        e1 = Event(owner=self.users[0])
+        e1.from_dict(self.feed_record('1', 'a'))
+        db.session.add(e1)
+        db.session.commit()
+        with mock.patch.object(Event, 'set_hash', autospec=True) as set_hash:
+            self.users[0].last_seen = datetime.now(timezone.utc)
+            e1.location_lat = 0.0
+            db.session.commit()
+            set_hash.assert_not_called()
+            e1.description = 'changed'
+            db.session.commit()
+            set_hash.assert_called_once_with(e1)
+
+    def test_14_geocode_cache(self):
+        clock = mock.Mock(return_value=1000.0)
+        with tempfile.TemporaryDirectory() as tmp:
+            self.app.config['GEOCODE_CACHE_PATH'] = os.path.join(tmp, 'geocode.db')
+            cache = GeocodeCache(self.app, clock=clock)
+            geocoder = mock.Mock(side_effect=lambda address: (41.88, -87.83) if 'oak' in address.lower() else None)
+            self.assertEqual(cache.lookup('104 Oak St, Maywood', geocoder), (41.88, -87.83))
+            self.assertEqual(cache.lookup('  104 OAK st,  maywood ', geocoder), (41.88, -87.83))
+            self.assertIsNone(cache.lookup('nowhere', geocoder))
+            self.assertIsNone(cache.lookup('nowhere', geocoder))
+            self.assertEqual(geocoder.call_count, 2)
+            self.assertEqual(cache.stats, {'hits': 1, 'negative_hits': 1, 'misses': 2, 'stores': 2})
+            #persistent tier survives a restart; negative entries expire first
+            cache = GeocodeCache(self.app, clock=clock)
+            clock.return_value += self.app.config['GEOCODE_NEGATIVE_TTL'] + 1
+            self.assertEqual(cache.lookup('104 Oak St, Maywood', geocoder), (41.88, -87.83))
+            self.assertIsNone(cache.lookup('nowhere', geocoder))
+            self.assertEqual(geocoder.call_count, 3)
+            cache.clear()
+        #relative paths live in the instance folder rather than the source tree
+        self.app.config['GEOCODE_CACHE_PATH'] = 'geocode.db'
+        self.assertEqual(GeocodeCache(self.app).path, os.path.join(self.app.instance_path, 'geocode.db'))
+
+    def test_15_geocode_queue(self):
+        requested = []
+        class CensusStub(BaseHTTPRequestHandler):
+            def do_GET(self):
+                address = parse_qs(urlparse(self.path).query)['address'][0]
+                requested.append(address)
+                matches = [{'coordinates': {'x': -87.83, 'y': 41.88}}] if 'Oak' in address else []
+                body = json.dumps({'result': {'addressMatches': matches}}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        server = HTTPServer(('127.0.0.1', 0), CensusStub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.app.config['GEOCODE_ASYNC'] = True
+        try:
+            #the maps link is geocoded by its address, so it shares the plain address's lookup
+            for i, address in enumerate(['104 Oak St, Maywood, IL', '104 Oak St, Maywood, IL', 'Nowhere',
+                                         'https://maps.google.com/?q=104+Oak+St,+Maywood,+IL']):
+                e = Event(owner=self.users[0])
+                e.from_dict({**self.feed_record(str(i), 'a'), 'location': address})
+                db.session.add(e)
+            db.session.commit()
+            self.assertEqual(db.session.scalar(sa.select(sa.func.count()).where(Event.geocode_pending)), 4)
+            backend = CensusBackend(url=f'http://127.0.0.1:{server.server_port}/')
+            sleep = mock.Mock()
+            queue = GeocodeQueue(backend, limiter=RateLimiter(2.0, clock=mock.Mock(return_value=0.0), sleep=sleep))
+            self.assertEqual(queue.run_batch(), {'addresses': 3, 'resolved': 2, 'failed': 1, 'errors': 0, 'events': 4})
+            sleep.assert_called_once_with(0.5) #second backend call waits out the 2 req/s budget
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(sorted(requested), ['104 Oak St, Maywood, IL', 'Nowhere'])
+        events = db.session.scalars(sa.select(Event).order_by(Event.original_event_id)).all()
+        self.assertEqual([(e.location_lat, e.geocode_pending) for e in events],
+                         [(41.88, False), (41.88, False), (None, False), (41.88, False)])
+
+    def test_16_parse_coordinates(self):
+        cases = {
+            '40.7128, -74.0060': (40.7128, -74.006),
+            '40.7128N, 74.0060W': (40.7128, -74.006),
+            'N 40.7128 W 74.0060': (40.7128, -74.006),
+            '40°42\'46"N, 74°0\'22"W': (40.712778, -74.006111),
+            '40 42 46 N 74 0 22 W': (40.712778, -74.006111),
+            '91, 10': None,
+            '-40S, 10E': None,
+            '104 Oak St, Maywood, IL 60153': None,
+        }
+        for text, expected in cases.items():
+            coords = parse_coordinates(text)
+            if expected is None:
+                self.assertIsNone(coords, text)
+            else:
+                self.assertAlmostEqual(coords[0], expected[0], places=5, msg=text)
+                self.assertAlmostEqual(coords[1], expected[1], places=5, msg=text)
+        with mock.patch.object(location.geocache, 'lookup', side_effect=AssertionError('geocoder called')):
+            self.assertEqual(location.parse_location('https://maps.google.com/?q=41.886236488388,-87.834408828447'),
+                             (41.886236488388, -87.834408828447))
+            self.assertEqual(location.parse_location('https://www.google.com/maps/place/Trailhead/@41.8862,-87.8344,17z'),
+                             (41.8862, -87.8344))
+            parsed = location.parse_locations(['41.88, -87.83', '41.88, -87.83', 'https://example.com/', ''])
+            self.assertEqual(parsed['41.88, -87.83'], (41.88, -87.83))
+            self.assertIsInstance(parsed['https://example.com/'], ValueError)
+            #a location that failed in the bulk pass is not parsed again per record
+            with mock.patch.object(location, 'parse_location', side_effect=ValueError) as parse:
+                data = Event.normalize({'location': 'https://example.com/'}, parsed)
+            parse.assert_not_called()
+            self.assertNotIn('location_lat', data)
+        self.assertRaises(ValueError, location.parse_location, 'https://example.com/map')
+
+    def test_17_openlands_concurrent_fetch(self):
+        #the first detail page is the slowest; results still come back in listing order
+        with serve_cervis_fixtures(delays={'2820': 0.3}) as handler:
+            events = feeds.Openlands.get()
+        self.assertEqual([e['original_event_id'] for e in events], ['2820', '2821-1', '2821-2'])
+        self.assertEqual(events[0]['title'], 'Trail Stewardship at Deer Grove')
+        self.assertEqual(events[0]['starts_at'], '2025-05-21T00:30:00+00:00')
+        self.assertEqual(events[2]['starts_at'], '2025-06-14T14:00:00+00:00')
+        self.assertEqual(len(handler.requests), 4) #listing plus three detail pages
+
+    def test_18_openlands_conditional_fetch(self):
+        for etags in [True, False]:
+            with serve_cervis_fixtures(etags=etags) as handler:
+                with mock.patch.object(feeds.Openlands, 'http', feeds.HttpClient()):
+                    first = feeds.Openlands.get()
+                    second = feeds.Openlands.get()
+                    stats = feeds.cache_stats()['Openlands']
+            self.assertEqual(first, second)
+            #the second refresh only requests the listing: a 304 with validators, otherwise an
+            #identical body whose previous parse is reused
+            self.assertEqual(len(handler.requests), 5)
+            self.assertEqual(stats['not_modified' if etags else 'unchanged'], 1)
+            self.assertEqual(stats['parsed'], 4)
+        #detail pages are revalidated on their own once detail_max_age has passed, so an edit
+        #made only on a detail page is picked up although the listing is unchanged
+        clock = [0.0]
+        with serve_cervis_fixtures() as handler:
+            with mock.patch.object(feeds.Openlands, 'http', feeds.HttpClient(clock=lambda: clock[0])):
+                feeds.Openlands.get()
+                handler.edits['eventdetail_2820'] = (b'Trail Stewardship', b'Trail Care')
+                self.assertEqual(feeds.Openlands.get()[0]['title'], 'Trail Stewardship at Deer Grove')
+                clock[0] += feeds.Openlands.detail_max_age
+                start = len(handler.requests)
+                self.assertEqual(feeds.Openlands.get()[0]['title'], 'Trail Care at Deer Grove')
+                stats = feeds.cache_stats()['Openlands']
+        self.assertEqual(len(handler.requests) - start, 4)
+        #304s: the listing twice, then 2821 and 2822; 2820 is parsed again
+        self.assertEqual((stats['not_modified'], stats['parsed']), (4, 5))
+        #a full Feed.refresh of an unchanged listing takes the same short cut
+        f1 = self.create_feed()
+        with serve_cervis_fixtures() as handler:
+            with mock.patch.object(feeds.Openlands, 'http', feeds.HttpClient()):
+                self.assertEqual(f1.refresh(incremental=False)['inserted'], 3)
+                start = len(handler.requests)
+                self.assertEqual(f1.refresh(incremental=False)['unchanged'], 3)
+        self.assertEqual(len(handler.requests) - start, 1)
+        #with a store, a new client (a restarted worker) revalidates instead of refetching
+        with tempfile.TemporaryDirectory() as tmp:
+            self.app.config['FEED_HTTP_CACHE_PATH'] = os.path.join(tmp, 'http.db')
+            store = HttpCacheStore(self.app)
+            with serve_cervis_fixtures() as handler:
+                with mock.patch.object(feeds.Openlands, 'http', feeds.HttpClient(store=store)):
+                    first = feeds.Openlands.get()
+                with mock.patch.object(feeds.Openlands, 'http', feeds.HttpClient(store=store)):
+                    self.assertEqual(feeds.Openlands.get(), first)
+                    stats = feeds.cache_stats()['Openlands']
+            store.close()
+        #the listing gets a 304 and its stored parse; the details were checked just now
+        self.assertEqual((stats['requests'], stats['not_modified'], stats['fresh'], stats['parsed']),
+                         (1, 1, 3, 0))
+
+    def test_19_openlands_parse_details(self):
+        with open(os.path.join(FIXTURES, 'cervis', 'eventdetail_2821.html'), 'rb') as f:
+            content = f.read()
+        for parser in ['html.parser', feeds.HTML_PARSER]:
+            with mock.patch.object(feeds, 'HTML_PARSER', parser):
+                details = feeds.Openlands.parseEventDetails('2821', content)
+            self.assertEqual(details['opportunity_name'], 'Seed Collection Workdays')
+            self.assertEqual(details['meeting_location_desc'], 'Somme Prairie Grove')
+            self.assertEqual(details['organizer'], {'organizer_name': 'Sam Lee',
+                                                    'organizer_email': 'sam.lee@example.org',
+                                                    'organizer_phone': []})
+            self.assertEqual(details['category'], 'Seed Collection')
+            self.assertEqual([slot['SpotsAvailable'] for slot in details['slots']], ['5', -1])
+            self.assertEqual(details['start_time'], '2025-06-07T14:00:00+00:00')
+
+    def test_20_feed_refresh_incremental(self):
+        f1 = self.create_feed()
+        def refresh(handler):
+            #returns the refresh summary and the detail pages it requested
+            start = len(handler.requests)
+            summary = f1.refresh(bulk=bulk, incremental=True)
+            return summary, {parse_qs(urlparse(r).query)['event_id'][0]
+                             for r in handler.requests[start:] if 'eventdetail' in r}
+        for bulk in [False, True]:
+            db.session.execute(sa.delete(Event))
+            with serve_cervis_fixtures() as handler:
+                with mock.patch.object(feeds.Openlands, 'http', feeds.HttpClient()):
+                    summary, fetched = refresh(handler)
+                    self.assertEqual(fetched, {'2820', '2821', '2822'})
+                    self.assertEqual((summary['inserted'], summary['new']), (3, 3))
+                    #stored events are not due yet; only 2822, which has no event time and so
+                    #was never stored, is fetched again
+                    summary, fetched = refresh(handler)
+                    self.assertEqual(fetched, {'2822'})
+                    self.assertEqual((summary['skipped'], summary['unchanged']), (3, 0))
+                    self.assertEqual(db.session.scalar(sa.select(sa.func.count(Event.id))), 3)
+                    #every stored id is due; one revalidation per refresh, oldest check first
+                    self.app.config.update(FEED_REVALIDATE_AFTER=0, FEED_REVALIDATE_BATCH=1)
+                    summary, fetched = refresh(handler)
+                    self.assertEqual(fetched, {'2820', '2822'})
+                    self.assertEqual((summary['revalidated'], summary['unchanged'], summary['skipped']), (1, 1, 2))
+                    summary, fetched = refresh(handler)
+                    self.assertEqual(fetched, {'2821', '2822'})
+                    self.assertEqual((summary['revalidated'], summary['unchanged']), (1, 2))
+                    self.app.config.update(FEED_REVALIDATE_AFTER=24 * 3600, FEED_REVALIDATE_BATCH=20)
+                    #an id that leaves the listing is deleted without fetching its details
+                    with mock.patch.object(feeds.Openlands, 'list_event_ids', return_value=['2820', '2822']):
+                        summary, fetched = refresh(handler)
+                    self.assertEqual(fetched, {'2822'})
+                    self.assertEqual(summary['deleted'], 2)
+            ids = db.session.scalars(sa.select(Event.original_event_id)).all()
+            self.assertEqual(ids, ['2820'])
+
+    def test_21_feed_refresh_streams_batches(self):
+        f1 = self.create_feed()
+        self.app.config.update(FEED_BATCH_SIZE=2, FEED_BULK_CHUNK_SIZE=2)
+        for bulk in [False, True]:
+            db.session.execute(sa.delete(Event))
+            stored = []
+            def stream():
+                #records how many events were written before each one is produced
+                for i in range(5):
+                    stored.append(db.session.scalar(sa.select(sa.func.count(Event.id))))
+                    yield self.feed_record(str(i), f'event {i}')
+            with mock.patch.object(feeds.Openlands, 'iter_events', side_effect=stream):
+                summary = f1.refresh(bulk=bulk)
+            self.assertEqual(summary, {'inserted': 5, 'updated': 0, 'deleted': 0, 'unchanged': 0})
+            self.assertEqual(stored, [0, 0, 2, 2, 4])
+        with serve_cervis_fixtures() as handler:
+            with mock.patch.object(feeds.Openlands, 'http', feeds.HttpClient(max_workers=2)):
+                streamed = list(feeds.Openlands().iter_events())
+                self.assertEqual(streamed, feeds.Openlands.get())
+
+    def test_22_feed_source_registry(self):
+        class JsonSource(sources.FeedAdapter):
+            fields = sources.FieldMap({
+                'title': 'name',
+                'starts_at': 'start',
+                'original_event_id': ('id', str),
+                'original_event_category': ('tags', lambda tags: ', '.join(tags or []) or None),
+            })
+
+            def records(self):
+                yield {'id': 7, 'name': 'Bird walk', 'start': '2025-05-21T12:00:00+00:00', 'tags': ['birds']}
+                yield {'id': 8, 'name': 'Night hike', 'start': '2025-05-22T02:00:00+00:00'}
+
+        self.assertIs(sources.get_source('Openlands'), feeds.Openlands)
+        self.assertIsNone(sources.get_source('JsonSource'))
+        self.assertEqual(JsonSource.fields({'id': 8, 'name': 'Night hike'}),
+                         {'title': 'Night hike', 'starts_at': None, 'original_event_id': '8',
+                          'original_event_category': None})
+        with mock.patch.dict(sources.SOURCES), mock.patch.dict(sources._loaded):
+            sources.register('JsonSource', JsonSource)
+            o1 = User(username='Audubon', account_type='Organization')
+            f1 = Feed(name='Walks', type='JsonSource', owner=o1)
+            db.session.add_all([o1, f1])
+            db.session.commit()
+            self.assertEqual(f1.refresh()['inserted'], 2)
+        events = db.session.scalars(f1.events.select().order_by(Event.starts_at)).all()
+        self.assertEqual([(e.title, e.original_event_category) for e in events],
+                         [('Bird walk', 'birds'), ('Night hike', None)])
+        class NoRecords(sources.FeedAdapter): #records() is required
+            fields = JsonSource.fields
+        with self.assertRaises(TypeError):
+            NoRecords()
+
+    def test_23_startup_defers_heavy_imports(self):
+        #scraping, crawling and geocoding libraries load on first use, not in create_app()
+        self.assertEqual(probe_startup()['loaded'], [])
+
+    def test_24_scheduler_refreshes_due_feeds(self):
+        class BrokenSource(sources.FeedAdapter):
+            def records(self):
+                raise RuntimeError('listing unavailable')
+                yield
+
+        now = datetime.now(timezone.utc)
+        f1 = self.create_feed()
+        f2 = Feed(name='Broken', type='Broken', owner=f1.owner)
+        f3 = Feed(name='Fresh', type='Openlands', owner=f1.owner, refresh_interval=3600)
+        f1.last_refresh = now - timedelta(hours=7) #past the default 6h interval
+        f2.last_refresh = now - timedelta(days=1)
+        f3.last_refresh = now - timedelta(minutes=30)
+        db.session.add_all([f2, f3])
+        db.session.commit()
+        self.assertEqual(due_feeds(), [f2, f1])
+        delays = []
+        scheduler = Scheduler(self.app, max_workers=2, jitter=5.0, sleep=delays.append)
+        with mock.patch.dict(sources.SOURCES, Broken=BrokenSource), mock.patch.dict(sources._loaded), \
+                mock.patch.object(feeds.Openlands, 'list_event_ids', return_value=['1']), \
+                mock.patch.object(feeds.Openlands, 'iter_events', return_value=[self.feed_record('1', 'a')]):
+            runs = {run['feed_id']: run for run in scheduler.run_once()}
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(all(0 <= delay <= 5.0 for delay in delays))
+        self.assertEqual((runs[f1.id]['status'], runs[f1.id]['inserted']), ('ok', 1))
+        self.assertEqual(runs[f2.id]['status'], 'failed')
+        self.assertEqual(runs[f2.id]['error'], 'RuntimeError: listing unavailable')
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count(FeedRun.id))), 2)
+        #both refreshed feeds, including the failed one, wait for their next interval
+        self.assertEqual(due_feeds(), [])
+        self.assertEqual(due_feeds(now + timedelta(hours=1)), [f3])
+        #feeds that are not due are filtered out by the query rather than loaded
+        loaded = []
+        def on_load(feed, context):
+            loaded.append(feed.id)
+        f3_id = f3.id
+        db.session.expunge_all()
+        sa.event.listen(Feed, 'load', on_load)
+        try:
+            due_feeds(now + timedelta(hours=1))
+        finally:
+            sa.event.remove(Feed, 'load', on_load)
+        self.assertEqual(loaded, [f3_id])
+
+    def test_25_refresh_run_timings(self):
+        ticks = iter(range(100))
+        timings = instrument.Timings(clock=lambda: next(ticks))
+        with timings.stage('write'):            #ticks 0-1 and 4-5
+            with timings.stage('normalize'):    #ticks 1-2 and 3-4
+                with timings.stage('geocode'):  #ticks 2-3
+                    pass
+        #nested time is not counted again in the enclosing stages
+        self.assertEqual((timings.stages['write'], timings.stages['normalize'], timings.stages['geocode']),
+                         (2, 2, 1))
+        f1 = self.create_feed()
+        with serve_cervis_fixtures() as handler:
+            with mock.patch.object(feeds.Openlands, 'http', feeds.HttpClient()):
+                run = record_refresh(f1.id, incremental=False)
+                again = record_refresh(f1.id, incremental=False)
+        #the second run revalidates the listing and reuses the recently checked detail pages
+        self.assertEqual([(r['http_requests'], r['http_fresh'], r['http_not_modified']) for r in [run, again]],
+                         [(4, 0, 0), (1, 3, 1)])
+        sizes = [os.path.getsize(os.path.join(FIXTURES, 'cervis', name)) for name in
+                 ['eventwebreglist.html', 'eventdetail_2820.html', 'eventdetail_2821.html', 'eventdetail_2822.html']]
+        self.assertEqual((run['status'], run['inserted']), ('ok', 3))
+        self.assertEqual(run['bytes_downloaded'], sum(sizes))
+        for stage in instrument.STAGES:
+            self.assertGreater(run[f'{stage}_seconds'], 0, stage)
+        (feed, runs, avg, longest, failed, requests, fresh, not_modified), = slowest_feeds()
+        self.assertEqual((feed.id, runs, failed, requests, fresh, not_modified), (f1.id, 2, 0, 5, 3, 1))
+        self.assertEqual({stage for stage, _ in stage_averages()}, set(instrument.STAGES))
+        output = self.app.test_cli_runner().invoke(args=['feeds', 'report']).output
+        self.assertIn('Cervis', output)
+        #an unknown feed is reported, not recorded as a failed run
+        self.assertIsNone(record_refresh(999))
+        result = self.app.test_cli_runner().invoke(args=['feeds', 'refresh', '999'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('no such feed: 999', result.output)
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count(FeedRun.id))), 2)
+
+    def test_26_keyset_pagination(self):
+        base = datetime(2025, 5, 1)
+        #pairs of events share a start time, so the id breaks ties
+        db.session.add_all([Event(owner=self.users[i % 4], title=f'e{i}', starts_at=base + timedelta(days=i // 2))
+                            for i in range(25)])
+        db.session.commit()
+        columns = (Event.starts_at, Event.id)
+        expected = db.session.scalars(sa.select(Event.id).order_by(Event.starts_at, Event.id)).all()
+        pages, cursor = [], None
+        while True:
+            page = keyset_paginate(sa.select(Event), columns, 10, cursor)
+            pages.append([e.id for e in page.items])
+            if not page.next_cursor:
+                break
+            cursor = page.next_cursor
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), expected)
+        #back from the last page
+        previous = keyset_paginate(sa.select(Event), columns, 10, page.prev_cursor, count=True)
+        self.assertEqual([e.id for e in previous.items], pages[1])
+        self.assertEqual(previous.total, 25)
+        first = keyset_paginate(sa.select(Event), columns, 10, previous.prev_cursor)
+        self.assertEqual([e.id for e in first.items], pages[0])
+        self.assertIsNone(first.prev_cursor)
+        self.assertRaises(InvalidCursor, decode_cursor, 'not-a-cursor', columns)
+
+        client = self.app.test_client()
+        data = client.get('/api/events?per_page=10&count=1').get_json()
+        self.assertEqual([e['id'] for e in data['items']], pages[0])
+        self.assertEqual(data['_meta']['total_items'], 25)
+        data = client.get(data['_links']['next']).get_json()
+        self.assertEqual([e['id'] for e in data['items']], pages[1])
+        self.assertNotIn('total_items', data['_meta'])
+        data = client.get('/api/events?page=3&per_page=10').get_json() #offset fallback
+        self.assertEqual(data['_meta']['total_pages'], 3)
+        self.assertEqual(client.get('/api/events?cursor=xyz').status_code, 400)
+        for per_page in [0, -1]: #raised to 1
+            data = client.get(f'/api/events?per_page={per_page}').get_json()
+            self.assertEqual([e['id'] for e in data['items']], pages[0][:1])
+            self.assertEqual(data['_meta']['per_page'], 1)
+        response = client.get('/explore')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'cursor=', response.data)
+
+    def test_27_event_filters(self):
+        f1 = self.create_feed()
+        o1 = f1.owner
+        base = datetime(2025, 5, 1, 12)
+        def event(title, days, lat=None, lon=None, owner=None, feed=None, category=None, hours=2):
+            return Event(title=title, starts_at=base + timedelta(days=days),
+                         ends_at=None if hours is None else base + timedelta(days=days, hours=hours),
+                         location_lat=lat, location_lon=lon, owner=owner or self.users[0], feed=feed,
+                         original_event_category=category)
+        db.session.add_all([
+            event('chicago', 0, 41.88, -87.63, category='Restoration'),
+            event('no end', 0.5, hours=None),
+            event('evanston', 1, 42.05, -87.68, owner=self.users[1]),
+            event('deer grove', 2, 42.14, -88.07, owner=o1, feed=f1, category='Restoration'),
+            event('fiji', 3, -17.7, 178.0),
+            event('samoa', 4, -13.8, -172.1),
+            event('unplaced', 5),
+        ])
+        db.session.commit()
+        client = self.app.test_client()
+        def titles(query):
+            response = client.get(f'/api/events?{query}')
+            self.assertEqual(response.status_code, 200, response.get_json())
+            return [e['title'] for e in response.get_json()['items']]
+        self.assertEqual(titles('starts_after=2025-05-02T12:00:00Z&starts_before=2025-05-04T13:00:00Z'),
+                         ['evanston', 'deer grove', 'fiji'])
+        #07:30 in Chicago is 12:30 UTC, half an hour into the first event
+        self.assertEqual(titles('ends_after=2025-05-01T07:30:00-05:00&ends_before=2025-05-02T14:30:00Z'),
+                         ['chicago', 'no end', 'evanston'])
+        #an event with no end counts as ending when it starts
+        self.assertEqual(titles('ends_before=2025-05-02T00:00:01Z'), ['chicago', 'no end'])
+        self.assertEqual(titles('ends_after=2025-05-02T00:00:01Z&ends_before=2025-05-02T14:30:00Z'), ['evanston'])
+        self.assertEqual(titles('owner=susan'), ['evanston'])
+        self.assertEqual(titles(f'feed={f1.id}'), ['deer grove'])
+        self.assertEqual(titles('category=Restoration'), ['chicago', 'deer grove'])
+        self.assertEqual(titles('bbox=-88.0,41.5,-87.0,42.5'), ['chicago', 'evanston'])
+        self.assertEqual(titles('bbox=170,-20,-170,-10'), ['fiji', 'samoa']) #across the antimeridian
+        data = client.get('/api/events?category=Restoration&per_page=1').get_json()
+        self.assertIn('category=Restoration', data['_links']['next'])
+        self.assertEqual([e['title'] for e in client.get(data['_links']['next']).get_json()['items']],
+                         ['deer grove'])
+        for query in ['starts_after=yesterday', 'bbox=1,2,3', 'bbox=0,95,1,96', 'feed=x']:
+            self.assertEqual(client.get(f'/api/events?{query}').status_code, 400, query)
+
+    def test_28_spatial_queries(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual([geohash.successor(p) for p in ['dp3', 'dp9', 'dpz', 'bzz', 'zz']], ['dp4', 'dpb', 'dq', 'c', None])
+        start = datetime(2025, 5, 1)
+        places = {'loop': (41.8781, -87.6298), 'evanston': (42.0451, -87.6877),
+                  'deer grove': (42.1395, -88.0736), 'fiji': (-17.7, 178.0), 'unplaced': (None, None)}
+        events = {title: Event(owner=self.users[0], title=title, starts_at=start, location_lat=lat, location_lon=lon)
+                  for title, (lat, lon) in places.items()}
+        db.session.add_all(events.values())
+        db.session.commit()
+        self.assertEqual(events['loop'].geohash, geohash.encode(41.8781, -87.6298))
+        self.assertIsNone(events['unplaced'].geohash)
+        events['unplaced'].location_lat, events['unplaced'].location_lon = 41.8827, -87.6233
+        db.session.commit()
+        self.assertEqual(events['unplaced'].geohash, geohash.encode(41.8827, -87.6233))
+        client = self.app.test_client()
+        data = client.get('/api/events/nearby?lat=41.8781&lon=-87.6298&km=25').get_json()
+        self.assertEqual([e['title'] for e in data['items']], ['loop', 'unplaced', 'evanston'])
+        self.assertAlmostEqual(data['items'][2]['distance_km'], 19.177, places=2)
+        data = client.get('/api/events/nearby?lat=-17.7&lon=-179.9&km=300').get_json()
+        self.assertEqual([e['title'] for e in data['items']], ['fiji']) #across the antimeridian
+        data = client.get('/api/events/tile/10/262/380').get_json()
+        self.assertEqual(sorted(e['title'] for e in data['items']), ['loop', 'unplaced'])
+        self.assertFalse(data['_meta']['truncated'])
+        #limits below 1 are raised to 1
+        data = client.get('/api/events/nearby?lat=41.8781&lon=-87.6298&km=25&limit=-1').get_json()
+        self.assertEqual(([e['title'] for e in data['items']], data['_meta']['limit']), (['loop'], 1))
+        data = client.get('/api/events/tile/10/262/380?limit=0').get_json()
+        self.assertEqual((len(data['items']), data['_meta']['truncated']), (1, True))
+        self.assertEqual(client.get('/api/events/nearby?lat=41.8').status_code, 400)
+        self.assertEqual(client.get('/api/events/tile/1/2/0').status_code, 400)
+        #bulk ingestion fills in the geohash too
+        f1 = self.create_feed()
+        with mock.patch.object(feeds.Openlands, 'iter_events', return_value=[self.feed_record('1', 'a')]):
+            f1.refresh(bulk=True)
+        self.assertEqual(db.session.scalar(f1.events.select()).geohash,
+                         geohash.encode(41.886236488388, -87.834408828447))
+
+    def test_29_following_events(self):
+        u1, u2, u3, u4 = self.users
+        start = datetime(2025, 5, 1)
+        e1, e2, e3, e4, e5 = [Event(owner=owner, title=f'event {i}', starts_at=start + timedelta(days=days))
+                              for i, (owner, days) in enumerate([(u1, 30), (u2, 4), (u3, 365), (u4, 56), (u4, 4)])]
+        db.session.add_all([e1, e2, e3, e4, e5])
+        u1.follow(u2)
+        u1.follow(u4)
+        u2.follow(u3)
+        u3.follow(u4)
+        u4.follow(u1)
+        u1.follow(u1) #following yourself does not duplicate your events
+        db.session.commit()
+        def timeline(user):
+            return db.session.scalars(user.following_events()).all()
+        self.assertEqual(timeline(u1), [e2, e5, e1, e4]) #ties on starts_at ordered by id
+        self.assertEqual(timeline(u2), [e2, e3])
+        self.assertEqual(timeline(u3), [e5, e4, e3])
+        self.assertEqual(timeline(u4), [e5, e1, e4])
+        u1.unfollow(u4)
+        db.session.commit()
+        self.assertEqual(timeline(u1), [e2, e1])
+        page = keyset_paginate(u3.following_events(), (Event.starts_at, Event.id), 2)
+        self.assertEqual(page.items, [e5, e4])
+        page = keyset_paginate(u3.following_events(), (Event.starts_at, Event.id), 2, page.next_cursor)
+        self.assertEqual(page.items, [e3])
+
+    def test_30_hot_query_plans(self):
+        u1, u2 = self.users[:2]
+        u1.follow(u2)
+        token = u1.get_token()
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(u1.id)
+        hot = {}
+        def run(name, fn):
+            with capture_selects() as statements:
+                fn()
+            self.assertTrue(statements, name)
+            hot[name] = statements
+        run('explore', lambda: client.get('/explore'))
+        run('user', lambda: client.get('/user/susan'))
+        run('feed', lambda: client.get('/feed'))
+        run('api events', lambda: client.get('/api/events?starts_after=2025-05-01'))
+        run('user calendar', lambda: client.get('/user/susan/events.ics').get_data())
+        authcache.clear() #a cache miss, as after the auth cache TTL
+        run('check_token', lambda: User.check_token(token))
+        f1 = self.create_feed()
+        records = [self.feed_record(str(i), f'event {i}') for i in range(3)]
+        with mock.patch.object(feeds.Openlands, 'iter_events', return_value=records):
+            run('refresh', lambda: f1.refresh(incremental=False))
+            run('bulk refresh', lambda: f1.refresh(bulk=True, incremental=False))
+            with mock.patch.object(feeds.Openlands, 'list_event_ids', return_value=['0', '1', '3']):
+                run('incremental refresh', lambda: f1.refresh())
+        for name, statements in hot.items():
+            for statement, parameters in statements:
+                plan = query_plan(statement, parameters)
+                self.assertEqual(full_scans(plan), [], f'{name}: {statement}\n' + '\n'.join(plan))
+                if name in ('explore', 'user', 'api events', 'user calendar'): #straight off an index
+                    self.assertEqual(sorts(plan), [], f'{name}: {statement}\n' + '\n'.join(plan))
+
+    def test_31_auth_cache(self):
+        u1 = self.users[0]
+        u1.set_password('cat')
+        u1.last_seen = datetime.now(timezone.utc) - timedelta(hours=1)
+        db.session.commit()
+        id = u1.id
+        client = self.app.test_client()
+        engine = db.engine
+        def request(method, url, **kwargs):
+            #each request gets its own app context, so flask.g and the session start empty
+            #as they do in production; returns the response and the queries reading users
+            self.app_context.pop()
+            try:
+                with capture_selects(engine) as statements:
+                    response = client.open(url, method=method, **kwargs)
+            finally:
+                self.app_context.push()
+            return response, [sql for sql, _ in statements if 'FROM user' in sql]
+        def last_seen():
+            return db.session.scalar(sa.select(User.last_seen).where(User.id == id))
+        response, _ = request('POST', '/api/tokens', auth=('john', 'cat'))
+        headers = {'Authorization': f'Bearer {response.get_json()["token"]}'}
+        response, lookups = request('GET', f'/api/users/{id}', headers=headers)
+        self.assertEqual(response.get_json()['username'], 'john')
+        self.assertEqual(len(lookups), 1) #the token; the user then comes from the identity map
+        response, lookups = request('GET', f'/api/users/{id}', headers=headers)
+        self.assertEqual((response.status_code, lookups), (200, []))
+        self.assertEqual(request('DELETE', '/api/tokens', headers=headers)[0].status_code, 204)
+        self.assertEqual(request('GET', f'/api/users/{id}', headers=headers)[0].status_code, 401)
+        #a copy cached by another request between the revoking flush and its commit is dropped
+        #at commit, and one loaded before an eviction is not cached after it
+        token = db.session.get(User, id).get_token()
+        db.session.commit()
+        user = User.check_token(token)
+        user.revoke_token()
+        db.session.flush()
+        authcache.set(User(id=id, username='john', token=token, token_expiration=datetime(2100, 1, 1)))
+        self.assertIsNotNone(authcache.get_token(token))
+        db.session.commit()
+        self.assertIsNone(authcache.get_token(token))
+        generation = authcache.generation
+        authcache.evict(id)
+        authcache.set(db.session.get(User, id), generation)
+        self.assertIsNone(authcache.get(id))
+        self.assertIsNone(User.check_token(token))
+        #sessions: load_user is cached and last_seen is written once per LAST_SEEN_INTERVAL
+        with client.session_transaction() as session:
+            session['_user_id'] = str(id)
+        hour_ago = last_seen()
+        _, lookups = request('GET', '/explore')
+        self.assertEqual(len(lookups), 1)
+        seen = last_seen()
+        self.assertGreater(seen, hour_ago)
+        for _ in range(3):
+            _, lookups = request('GET', '/explore')
+            self.assertEqual(lookups, [])
+        self.assertEqual(last_seen(), seen)
+        #writing the user drops the cached copy
+        self.assertIsNotNone(authcache.get(id))
+        db.session.get(User, id).about_me = 'edited'
+        db.session.commit()
+        self.assertIsNone(authcache.get(id))
+        lastseen.granularity = timedelta(0)
+        request('GET', '/explore')
+        self.assertGreater(last_seen(), seen)
+
+    def test_32_last_seen_buffer(self):
+        u1, u2 = self.users[:2]
+        buffer = LastSeenBuffer(self.app)
+        buffer.granularity = timedelta(minutes=5)
+        buffer.flush_interval = 60
+        start = datetime(2025, 5, 1, 12, tzinfo=timezone.utc)
+        for user in (u1, u2):
+            user.last_seen = start
+        db.session.commit()
+        def stored():
+            return db.session.execute(sa.select(User.username, User.last_seen).order_by(User.id)).all()[:2]
+        with mock.patch.object(buffer, 'start') as start_thread:
+            self.assertFalse(buffer.touch(u1, start + timedelta(seconds=59))) #below the granularity
+            self.assertTrue(buffer.touch(u1, start + timedelta(minutes=5)))
+            self.assertTrue(buffer.touch(u2, start + timedelta(minutes=6)))
+            self.assertFalse(buffer.touch(u1, start + timedelta(minutes=9)))
+            self.assertTrue(buffer.touch(u1, start + timedelta(minutes=10)))
+        start_thread.assert_called()
+        self.assertEqual(stored(), [('john', start.replace(tzinfo=None)), ('susan', start.replace(tzinfo=None))])
+        with capture_selects() as statements, \
+                mock.patch.object(db.session, 'commit', wraps=db.session.commit) as commit:
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual((statements, commit.call_count), ([], 1)) #one UPDATE, one transaction
+        db.session.expire_all()
+        self.assertEqual(stored(), [('john', datetime(2025, 5, 1, 12, 10)), ('susan', datetime(2025, 5, 1, 12, 6))])
+        self.assertEqual(buffer.flush(), 0)
+        #the flusher thread writes on its own, and shutdown writes what is left
+        buffer.flush_interval = 0.01
+        buffer.touch(u2, start + timedelta(minutes=20))
+        for _ in range(200):
+            if not buffer.pending:
+                break
+            time.sleep(0.01)
+        buffer.shutdown()
+        db.session.expire_all()
+        self.assertEqual(stored()[1], ('susan', datetime(2025, 5, 1, 12, 20)))
+        buffer.flush_interval = 60
+        with mock.patch.object(buffer, 'start'):
+            buffer.touch(u1, start + timedelta(minutes=30))
+        buffer.shutdown()
+        db.session.expire_all()
+        self.assertEqual(stored()[0], ('john', datetime(2025, 5, 1, 12, 30)))
+
+    def test_33_icalendar_export(self):
+        line = 'DESCRIPTION:' + 'é' * 100
+        folded = icalendar.fold(line)
+        self.assertTrue(all(len(part.encode()) <= 75 for part in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', ''), line + '\r\n')
+        self.assertEqual(icalendar.escape_text('a, b; c\\d\ne'), 'a\\, b\\; c\\\\d\\ne')
+        u1, u2, u3 = self.users[:3]
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        e1 = Event(owner=u1, title='Walk, talk', description='first\nsecond', starts_at=now + timedelta(days=1),
+                   ends_at=now + timedelta(days=1, hours=2), location='Park', original_event_category='hike, birds')
+        e2 = Event(owner=u2, title='Cleanup', starts_at=now + timedelta(days=2))
+        e3 = Event(owner=u3, title='Not followed', starts_at=now + timedelta(days=3))
+        old = Event(owner=u1, title='Long ago', starts_at=now - timedelta(days=365))
+        c1 = Collection(title='Weekend', owner=u1)
+        db.session.add_all([e1, e2, e3, old, c1])
+        u1.follow(u2)
+        db.session.commit()
+        c1.add_event(e3)
+        db.session.commit()
+        client = self.app.test_client()
+        def uids(response):
+            body = response.get_data(as_text=True)
+            self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\nVERSION:2.0\r\n'))
+            self.assertTrue(body.endswith('END:VCALENDAR\r\n'))
+            return [int(line.split('-')[1].split('@')[0]) for line in body.split('\r\n') if line.startswith('UID:')]
+        response = client.get('/user/john/events.ics')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/calendar')
+        self.assertEqual(uids(response), [e1.id]) #past the ICS_PAST_DAYS window
+        body = response.get_data(as_text=True)
+        for line in ['SUMMARY:Walk\\, talk', 'DESCRIPTION:first\\nsecond', 'LOCATION:Park', 'CATEGORIES:hike,birds',
+                     f'DTSTART:{(now + timedelta(days=1)).strftime("%Y%m%dT%H%M%SZ")}']:
+            self.assertIn(line + '\r\n', body)
+        #the follow timeline is only served under the user's calendar token
+        calendar = f'/user/john/following/{u1.get_calendar_token()}.ics'
+        db.session.commit()
+        self.assertEqual(uids(client.get(calendar)), [e1.id, e2.id])
+        self.assertEqual(client.get('/user/john/following.ics').status_code, 404)
+        self.assertEqual(client.get(f'/user/john/following/{"0" * 32}.ics').status_code, 404)
+        self.assertEqual(client.get(f'/user/susan/following/{u1.calendar_token}.ics').status_code, 404)
+        self.assertNotIn('calendar_token', u1.to_dict())
+        self.assertEqual(uids(client.get(f'/collection/{c1.id}/events.ics')), [e3.id])
+        self.assertEqual(client.get('/user/nobody/events.ics').status_code, 404)
+        #polls with the current ETag get a 304 without the events being read
+        response = client.get(calendar)
+        etag = response.headers['ETag']
+        self.assertFalse(response.headers['ETag'].startswith('W/'))
+        with capture_selects() as statements:
+            response = client.get(calendar, headers={'If-None-Match': etag})
+        self.assertEqual((response.status_code, response.data), (304, b''))
+        self.assertFalse(any('event.title' in sql for sql, _ in statements))
+        e2.title = 'Park cleanup'
+        db.session.commit()
+        response = client.get(calendar, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('SUMMARY:Park cleanup', response.get_data(as_text=True))
+        self.assertNotEqual(response.headers['ETag'], etag)
+        f1 = self.create_feed()
+        record = {**self.feed_record('1', 'a'), 'starts_at': (now + timedelta(days=5)).isoformat(), 'ends_at': None}
+        with mock.patch.object(feeds.Openlands, 'iter_events', return_value=[record]):
+            f1.refresh(bulk=True)
+        self.assertEqual(uids(client.get(f'/feeds/{f1.id}/events.ics')),
+                         [db.session.scalar(f1.events.select()).id])
     # def test_07_collection(self):
     #     #add event to self
     #     #remove event from self